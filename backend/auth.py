@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+import jwt
+from fastapi import HTTPException, Request
+from services.clients import fetch, token_key
+
+# id_token verification against Auth0. The JWKS is fetched once, refreshed in
+# the background and on an unknown key id; decoded claims are memoized per
+# token until they expire, so a token costs one signature check.
+
+JWKS_REFRESH_INTERVAL = float(os.environ.get('JWKS_REFRESH_INTERVAL', '3600'))
+JWKS_MIN_REFETCH = 60.0  # at most one on-demand refetch per minute (unknown kid)
+CLAIMS_CACHE_SIZE = int(os.environ.get('CLAIMS_CACHE_SIZE', '10000'))
+LEEWAY = 30
+# Auth0 signs id_tokens with RS256 by default. Applications switched to HS256
+# sign with the client secret instead; accept that only when asked to.
+ALLOW_HS256 = os.environ.get('AUTH0_ALLOW_HS256') == '1'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+_keys = {}
+_keys_fetched_at = 0.0
+_keys_lock = asyncio.Lock()
+_refresh_task = None
+_claims = OrderedDict()
+
+
+def _domain():
+    return os.environ.get('AUTH0_DOMAIN')
+
+
+async def refresh_jwks():
+    global _keys, _keys_fetched_at
+    domain = _domain()
+    if not domain:
+        return
+    resp = await fetch('auth0', f"https://{domain}/.well-known/jwks.json")
+    resp.raise_for_status()
+    keys = {}
+    for jwk in resp.json().get('keys', []):
+        try:
+            keys[jwk.get('kid')] = jwt.PyJWK(jwk)
+        except jwt.PyJWTError as e:
+            print(f"Skipping unusable JWKS key {jwk.get('kid')}: {e}")
+    _keys = keys
+    _keys_fetched_at = time.monotonic()
+
+
+async def _signing_key(kid):
+    if kid in _keys:
+        return _keys[kid]
+    async with _keys_lock:
+        # Key rotation: refetch, but don't let bad tokens hammer Auth0
+        if kid not in _keys and time.monotonic() - _keys_fetched_at > JWKS_MIN_REFETCH:
+            await refresh_jwks()
+    if kid not in _keys:
+        raise InvalidToken(f"Unknown signing key {kid}")
+    return _keys[kid]
+
+
+async def _refresh_loop():
+    while True:
+        try:
+            await refresh_jwks()
+        except Exception as e:
+            print(f"JWKS refresh error: {e}")
+        await asyncio.sleep(JWKS_REFRESH_INTERVAL)
+
+
+def start():
+    global _refresh_task
+    if _refresh_task is None and _domain():
+        _refresh_task = asyncio.ensure_future(_refresh_loop())
+
+
+async def stop():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+
+
+async def verify(token: str) -> dict:
+    """Return the verified claims of an Auth0 id_token, raising InvalidToken."""
+    key = token_key(token)
+    cached = _claims.get(key)
+    now = time.time()
+    if cached is not None:
+        if cached[0] > now:
+            _claims.move_to_end(key)
+            return cached[1]
+        del _claims[key]
+
+    domain = _domain()
+    if not domain:
+        raise InvalidToken('Auth0 configuration missing')
+    try:
+        header = jwt.get_unverified_header(token)
+        if header.get('alg') == 'HS256':
+            secret = os.environ.get('AUTH0_CLIENT_SECRET')
+            if not (ALLOW_HS256 and secret):
+                raise InvalidToken('HS256 tokens are not accepted')
+            signing_key, algorithms = secret, ['HS256']
+        else:
+            signing_key, algorithms = (await _signing_key(header.get('kid'))).key, ['RS256']
+        claims = jwt.decode(
+            token,
+            signing_key,
+            algorithms=algorithms,
+            audience=os.environ.get('AUTH0_CLIENT_ID'),
+            issuer=f"https://{domain}/",
+            leeway=LEEWAY,
+        )
+    except jwt.PyJWTError as e:
+        raise InvalidToken(str(e))
+
+    _claims[key] = (claims.get('exp', now) + LEEWAY, claims)
+    while len(_claims) > CLAIMS_CACHE_SIZE:
+        _claims.popitem(last=False)
+    return claims
+
+
+def user_from_claims(claims: dict) -> dict:
+    name = claims.get('name') or ''
+    return {
+        'id': claims.get('sub'),
+        'email': claims.get('email', ''),
+        'name': claims.get('name', ''),
+        'picture': claims.get('picture', ''),
+        'firstName': claims.get('given_name', name.split(' ')[0] if name else ''),
+        'lastName': claims.get('family_name', name.split(' ')[-1] if ' ' in name else ''),
+    }
+
+
+# === FASTAPI DEPENDENCIES ===
+
+async def current_claims(request: Request) -> dict:
+    id_token = request.cookies.get('id_token')
+    if not id_token:
+        raise HTTPException(status_code=401, detail='Not authenticated')
+    try:
+        claims = await verify(id_token)
+    except InvalidToken as e:
+        print(f"Error verifying token: {e}")
+        raise HTTPException(status_code=401, detail='Invalid token')
+    if not claims.get('sub'):
+        raise HTTPException(status_code=401, detail='Invalid token')
+    return claims
+
+
+async def optional_claims(request: Request):
+    # For routes that still work without an identity (e.g. /dashboard)
+    id_token = request.cookies.get('id_token')
+    if not id_token:
+        return None
+    try:
+        return await verify(id_token)
+    except InvalidToken as e:
+        print(f"Error verifying token: {e}")
+        return None
+
+
+async def current_user_id(request: Request) -> str:
+    return (await current_claims(request))['sub']
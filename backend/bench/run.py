@@ -0,0 +1,233 @@
+"""Latency/throughput benchmark for the API against local upstream stubs.
+
+Run from backend/:
+
+    python -m bench.run                                 # /dashboard and /user/profile
+    python -m bench.run --concurrency 1,10,50 --requests 500 --latency 80
+    python -m bench.run --save main                     # write bench/baselines/main.json
+    python -m bench.run --compare main                  # exit 1 on a regression
+
+Google, Graph, GitHub and Auth0 are served by bench.stubs through an httpx
+MockTransport, Firestore is replaced by db.MemoryBackend and geolocation by a
+generated table, so results only depend on this code and the chosen settings.
+The app is driven in-process over ASGI, lifespan included.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+DEFAULT_ROUTES = ['/dashboard', '/user/profile']
+CLIENT_IP = '81.2.69.160'
+AUTH0_DOMAIN = 'bench.auth0.local'
+AUTH0_CLIENT_ID = 'bench-client'
+
+
+def _configure_env():
+    # Must run before the app is imported: these are read at import time
+    os.environ['DB_BACKEND'] = 'memory'
+    os.environ['AUTH0_DOMAIN'] = AUTH0_DOMAIN
+    os.environ['AUTH0_CLIENT_ID'] = AUTH0_CLIENT_ID
+    os.environ.setdefault('REFRESH_INTERVAL', '3600')  # keep background refreshes out of the numbers
+    path = os.path.join(tempfile.mkdtemp(prefix='hub-bench-'), 'geoip.csv.gz')
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write('ip_start,ip_end,country_code,country,region,city,timezone\n')
+        f.write('81.2.69.0,81.2.69.255,GB,United Kingdom,England,London,Europe/London\n')
+        f.write('2001:db8::,2001:db8::ffff,NL,Netherlands,North Holland,Amsterdam,Europe/Amsterdam\n')
+    os.environ['GEOIP_DB'] = path
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Users:
+    """Pre-built cookies per synthetic user, so token signing isn't timed."""
+
+    def __init__(self, auth0):
+        self.auth0 = auth0
+        self._cookies = {}
+
+    def __call__(self, n: int):
+        cookie = self._cookies.get(n)
+        if cookie is None:
+            id_token = self.auth0.id_token(f"auth0|bench{n}", f"Bench User{n}", f"bench{n}@example.com")
+            cookie = self._cookies[n] = (f"bench-access-{n}", f"access_token=bench-access-{n}; id_token={id_token}")
+        return cookie
+
+
+async def _drive(client, route, users, first_user, user_count, concurrency, total):
+    latencies = []
+    failures = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for i in counter:
+            token, cookie = users(first_user + i % user_count)
+            started = time.perf_counter()
+            resp = await client.get(route.format(token=token), headers={'Cookie': cookie})
+            latencies.append(time.perf_counter() - started)
+            if resp.status_code >= 400:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': total,
+        'errors': failures,
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run(args):
+    _configure_env()
+    import httpx
+    import db
+    import main
+    from services import clients, policy
+    from bench.stubs import Auth0Stub, Upstreams
+
+    if args.upstream_rate:
+        for provider in policy.RATES:
+            policy.RATES[provider] = (args.upstream_rate, int(args.upstream_rate * 2))
+
+    auth0 = Auth0Stub(AUTH0_DOMAIN, AUTH0_CLIENT_ID)
+    upstreams = Upstreams(
+        auth0,
+        latency=args.latency / 1000,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        events=args.events,
+        messages=args.messages,
+        payload_bytes=args.payload_bytes,
+        latencies={p: ms / 1000 for p, ms in args.provider_latency.items()},
+        seed=args.seed,
+    )
+    clients.registry.use_transport(upstreams.transport())
+    db.use_backend(db.MemoryBackend())
+    users = Users(auth0)
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app, client=(CLIENT_IP, 50000))
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=60) as client:
+            next_user = 0
+            for route in args.routes:
+                for concurrency in args.concurrency:
+                    user_count = args.requests if args.cold else args.users
+                    if not args.cold:
+                        await _drive(client, route, users, next_user, user_count, concurrency, args.warmup)
+                    results[f"{route} @{concurrency}"] = await _drive(
+                        client, route, users, next_user, user_count, concurrency, args.requests)
+                    if args.cold:
+                        next_user += args.requests
+
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ('save', 'compare', 'tolerance', 'json')},
+        'results': results,
+        'upstream_calls': dict(upstreams.calls),
+        'upstream_errors': dict(upstreams.errors),
+    }
+
+
+def report(summary):
+    print(f"{'route':<32} {'req':>6} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for key, r in summary['results'].items():
+        print(f"{key:<32} {r['requests']:>6} {r['errors']:>5} {r['rps']:>9} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+    print(f"upstream calls: {summary['upstream_calls']}  injected errors: {summary['upstream_errors']}")
+
+
+def compare(summary, name, tolerance):
+    """Regressions against a saved baseline: p95 up or throughput down by more than `tolerance`."""
+    with open(os.path.join(BASELINE_DIR, f"{name}.json")) as f:
+        baseline = json.load(f)
+    if baseline.get('config') != summary['config']:
+        print('warning: baseline was recorded with different settings')
+    regressions = []
+    for key, current in summary['results'].items():
+        previous = baseline['results'].get(key)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {previous['rps']} -> {current['rps']} req/s")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{key}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def _csv(cast):
+    return lambda value: [cast(v) for v in value.split(',') if v]
+
+
+def _latencies(value):
+    # google=80,microsoft=150
+    return {k: float(v) for k, v in (pair.split('=') for pair in value.split(',') if pair)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--routes', nargs='+', default=DEFAULT_ROUTES,
+                        help='paths to benchmark; {token} is replaced by the access token')
+    parser.add_argument('--concurrency', type=_csv(int), default=[1, 10, 50])
+    parser.add_argument('--requests', type=int, default=300, help='measured requests per route and level')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--users', type=int, default=25, help='distinct users requests are spread over')
+    parser.add_argument('--cold', action='store_true', help='a new user for every request (no warm caches)')
+    parser.add_argument('--latency', type=float, default=50.0, help='upstream latency in ms')
+    parser.add_argument('--provider-latency', type=_latencies, default={}, help='e.g. google=80,microsoft=150')
+    parser.add_argument('--jitter', type=float, default=0.2, help='latency jitter as a fraction')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream calls answering 503')
+    parser.add_argument('--events', type=int, default=50, help='calendar events per provider')
+    parser.add_argument('--messages', type=int, default=50, help='mail messages per provider')
+    parser.add_argument('--payload-bytes', type=int, default=512, help='filler text per event/message')
+    parser.add_argument('--upstream-rate', type=float, default=None,
+                        help='override the per-provider client rate limit (req/s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='NAME', help='save results as bench/baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare with bench/baselines/NAME.json')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--json', action='store_true', help='print the raw results as JSON')
+    args = parser.parse_args(argv)
+
+    summary = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        report(summary)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved baseline to {path}")
+
+    if args.compare:
+        regressions = compare(summary, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
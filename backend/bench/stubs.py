@@ -0,0 +1,213 @@
+import asyncio
+import json
+import random
+import time
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+# Local stand-ins for every upstream the backend talks to (Google Calendar and
+# Gmail, Microsoft Graph, GitHub, Auth0), served through an httpx
+# MockTransport. Latency, error rate and payload sizes are configurable;
+# response bodies are built once and reused so the stubs themselves stay cheap.
+
+PROVIDER_HOSTS = {
+    'www.googleapis.com': 'google',
+    'gmail.googleapis.com': 'google',
+    'graph.microsoft.com': 'microsoft',
+    'api.github.com': 'github',
+}
+
+
+class Auth0Stub:
+    """Signs id_tokens with a local RSA key and serves the matching JWKS."""
+
+    def __init__(self, domain: str, client_id: str, kid: str = 'bench-key'):
+        self.domain = domain
+        self.client_id = client_id
+        self.kid = kid
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(RSAAlgorithm.to_jwk(self._key.public_key()))
+        self.jwks = {'keys': [{**jwk, 'kid': kid, 'use': 'sig', 'alg': 'RS256'}]}
+
+    def id_token(self, sub: str, name: str, email: str, lifetime: int = 3600) -> str:
+        now = int(time.time())
+        claims = {
+            'sub': sub,
+            'name': name,
+            'email': email,
+            'aud': self.client_id,
+            'iss': f"https://{self.domain}/",
+            'iat': now,
+            'exp': now + lifetime,
+        }
+        return jwt.encode(claims, self._key, algorithm='RS256', headers={'kid': self.kid})
+
+
+class Upstreams:
+    def __init__(self, auth0: Auth0Stub, latency: float = 0.05, jitter: float = 0.2,
+                 error_rate: float = 0.0, events: int = 50, messages: int = 50,
+                 payload_bytes: int = 512, latencies: dict = None, seed: int = 0):
+        self.auth0 = auth0
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.errors = {}
+
+        filler = 'x' * payload_bytes
+        start = time.time() - 7 * 86400
+        self.google_events = [{
+            'id': f"gevt{i}",
+            'etag': f'"{i}"',
+            'status': 'confirmed',
+            'summary': f"Event {i}",
+            'description': filler,
+            'hangoutLink': f"https://meet.google.com/abc-defg-{chr(97 + i % 26) * 3}" if i % 3 == 0 else None,
+            'start': {'dateTime': _iso(start + i * 3 * 3600)},
+            'end': {'dateTime': _iso(start + i * 3 * 3600 + 1800)},
+        } for i in range(events)]
+        self.graph_events = [{
+            'id': f"mevt{i}",
+            'changeKey': str(i),
+            'subject': f"Meeting {i}",
+            'body': {'contentType': 'text', 'content': filler},
+            'onlineMeeting': {'joinUrl': f"https://teams.microsoft.com/l/meetup-join/{i}"} if i % 2 == 0 else None,
+            'start': {'dateTime': _iso(start + i * 4 * 3600, 7), 'timeZone': 'UTC'},
+            'end': {'dateTime': _iso(start + i * 4 * 3600 + 3600, 7), 'timeZone': 'UTC'},
+        } for i in range(events)]
+        self.gmail_ids = [{'id': f"gmsg{i}", 'threadId': f"gthr{i}"} for i in range(messages)]
+        self.gmail_metadata = {m['id']: {
+            'id': m['id'],
+            'threadId': m['threadId'],
+            'labelIds': ['INBOX'],
+            'snippet': filler[:200],
+            'internalDate': str(int(start * 1000)),
+            'payload': {'headers': [
+                {'name': 'Subject', 'value': f"Message {m['id']}"},
+                {'name': 'From', 'value': 'sender@example.com'},
+                {'name': 'Date', 'value': 'Mon, 1 Jan 2024 00:00:00 +0000'},
+            ]},
+        } for m in self.gmail_ids}
+        self.outlook_messages = [{
+            'id': f"omsg{i}",
+            'subject': f"Mail {i}",
+            'from': {'emailAddress': {'address': 'sender@example.com'}},
+            'receivedDateTime': _iso(start, 0),
+            'isRead': bool(i % 2),
+            'bodyPreview': filler[:200],
+            'webLink': f"https://outlook.office.com/mail/{i}",
+        } for i in range(messages)]
+        self.github_profile = {'login': 'bench', 'name': 'Bench User', 'bio': filler[:160]}
+        self.github_emails = [{'email': 'bench@example.com', 'primary': True, 'verified': True}]
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def _provider(self, host: str):
+        if host == self.auth0.domain:
+            return 'auth0'
+        return PROVIDER_HOSTS.get(host, host)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        provider = self._provider(request.url.host)
+        self.calls[provider] = self.calls.get(provider, 0) + 1
+        delay = self.latencies.get(provider, self.latency)
+        if delay:
+            await asyncio.sleep(delay * self.random.uniform(1 - self.jitter, 1 + self.jitter))
+        if provider != 'auth0' and self.error_rate and self.random.random() < self.error_rate:
+            self.errors[provider] = self.errors.get(provider, 0) + 1
+            return httpx.Response(503, json={'error': 'stub failure'})
+        handler = getattr(self, f"_{provider}", None)
+        if handler is None:
+            return httpx.Response(404, json={'error': f"no stub for {request.url.host}"})
+        return handler(request)
+
+    # === providers ===
+
+    def _auth0(self, request):
+        if request.url.path == '/.well-known/jwks.json':
+            return httpx.Response(200, json=self.auth0.jwks)
+        return httpx.Response(404, json={'error': 'not stubbed'})
+
+    def _google(self, request):
+        path = request.url.path
+        params = request.url.params
+        if path.endswith('/calendars/primary/events'):
+            if 'syncToken' in params:
+                return httpx.Response(200, json={'items': [], 'nextSyncToken': 'sync-next'})
+            return _paged(self.google_events, params, 'items', 'nextPageToken', {'nextSyncToken': 'sync-1'})
+        if path.endswith('/users/me/profile'):
+            return httpx.Response(200, json={'historyId': '1000'})
+        if path.endswith('/users/me/messages'):
+            return httpx.Response(200, json={'messages': self.gmail_ids})
+        if path.endswith('/users/me/history'):
+            return httpx.Response(200, json={'history': [], 'historyId': '1000'})
+        if path == '/batch/gmail/v1':
+            return self._gmail_batch(request)
+        return httpx.Response(404, json={'error': 'not stubbed'})
+
+    def _gmail_batch(self, request):
+        boundary = 'bench_batch'
+        parts = []
+        for line in request.content.decode().split('\r\n'):
+            if not line.startswith('GET '):
+                continue
+            message_id = line.split('/messages/')[1].split('?')[0]
+            body = json.dumps(self.gmail_metadata.get(message_id, {'id': message_id}))
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n\r\n"
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{body}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return httpx.Response(200, content=''.join(parts).encode(),
+                              headers={'Content-Type': f'multipart/mixed; boundary={boundary}'})
+
+    def _microsoft(self, request):
+        path = request.url.path
+        delta = {'@odata.deltaLink': f"{str(request.url).split('?')[0]}?$deltatoken=next"}
+        if path.endswith('/calendarView/delta'):
+            if '$deltatoken' in request.url.params:
+                return httpx.Response(200, json={'value': [], **delta})
+            return httpx.Response(200, json={'value': self.graph_events, **delta})
+        if path.endswith('/mailFolders/inbox/messages/delta'):
+            if '$deltatoken' in request.url.params:
+                return httpx.Response(200, json={'value': [], **delta})
+            return httpx.Response(200, json={'value': self.outlook_messages, **delta})
+        if path.endswith('/$batch'):
+            by_id = {m['id']: m for m in self.outlook_messages}
+            requests = json.loads(request.content).get('requests', [])
+            return httpx.Response(200, json={'responses': [{
+                'id': r['id'],
+                'status': 200,
+                'body': by_id.get(r['url'].split('/messages/')[1].split('?')[0]),
+            } for r in requests]})
+        return httpx.Response(404, json={'error': 'not stubbed'})
+
+    def _github(self, request):
+        if request.url.path == '/user':
+            return httpx.Response(200, json=self.github_profile, headers={'ETag': '"bench-profile"'})
+        if request.url.path == '/user/emails':
+            return httpx.Response(200, json=self.github_emails, headers={'ETag': '"bench-emails"'})
+        return httpx.Response(404, json={'error': 'not stubbed'})
+
+
+def _paged(items, params, items_key, token_key, last_page):
+    size = int(params.get('maxResults', 250))
+    offset = int(params.get('pageToken', 0))
+    page = {items_key: items[offset:offset + size]}
+    if offset + size < len(items):
+        page[token_key] = str(offset + size)
+    else:
+        page.update(last_page)
+    return httpx.Response(200, json=page)
+
+
+def _iso(timestamp: float, digits: int = None) -> str:
+    value = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp))
+    if digits is None:
+        return value + 'Z'
+    return value + ('.' + '0' * digits if digits else '')
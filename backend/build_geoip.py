@@ -0,0 +1,149 @@
+"""Build the offline IP geolocation table (services/geo.py) from DB-IP.
+
+DB-IP publishes "IP to City Lite" monthly under CC BY 4.0, no account
+needed: https://db-ip.com/db/download/ip-to-city-lite
+
+    python build_geoip.py dbip-city-lite-2026-10.csv.gz
+    python build_geoip.py dbip-city-lite-2026-10.csv.gz --level country   # much smaller
+
+The input rows are `ip_start,ip_end,continent,country_code,region,city,
+latitude,longitude`. Country names and time zones are not part of it; they
+come from the tz database tables (iso3166.tab, zone.tab) shipped with the
+OS, the zone being the one nearest to the row's coordinates within its
+country. Adjacent ranges that end up with the same location are merged.
+The output is written to data/geoip.csv.gz, where the app looks by default
+(GEOIP_DB overrides it). Attribution: "IP Geolocation by DB-IP".
+"""
+import argparse
+import csv
+import gzip
+import ipaddress
+import math
+import os
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(BACKEND_DIR, 'data', 'geoip.csv.gz')
+TZ_DIRS = ('/usr/share/zoneinfo', '/usr/lib/zoneinfo', '/usr/share/lib/zoneinfo')
+# iso3166.tab uses short names for some countries; match what ip-api.com reported
+COUNTRY_NAMES = {'GB': 'United Kingdom', 'KR': 'South Korea', 'KP': 'North Korea'}
+
+
+def _tz_file(name: str, tz_dir: str = None):
+    for directory in ((tz_dir,) if tz_dir else TZ_DIRS):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    raise SystemExit(f"{name} not found; install tzdata or pass --tz-dir")
+
+
+def _rows(path: str, sep: str = '\t'):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                yield line.rstrip('\n').split(sep)
+
+
+def _coordinate(text: str, degree_digits: int) -> float:
+    # ISO 6709 as used by zone.tab: +DDMM[SS] / +DDDMM[SS]
+    sign = -1 if text[0] == '-' else 1
+    digits = text[1:]
+    value = int(digits[:degree_digits]) + int(digits[degree_digits:degree_digits + 2]) / 60
+    if len(digits) > degree_digits + 2:
+        value += int(digits[degree_digits + 2:]) / 3600
+    return sign * value
+
+
+def load_tz_tables(tz_dir: str = None):
+    countries = {row[0]: row[1] for row in _rows(_tz_file('iso3166.tab', tz_dir)) if len(row) >= 2}
+    countries.update(COUNTRY_NAMES)
+    zones = {}
+    for row in _rows(_tz_file('zone.tab', tz_dir)):
+        if len(row) < 3:
+            continue
+        coordinates = row[1]
+        split = max(coordinates.rfind('+'), coordinates.rfind('-'))
+        latitude = _coordinate(coordinates[:split], 2)
+        longitude = _coordinate(coordinates[split:], 3)
+        zones.setdefault(row[0], []).append((latitude, longitude, row[2]))
+    return countries, zones
+
+
+def nearest_zone(zones, country_code: str, latitude, longitude):
+    candidates = zones.get(country_code)
+    if not candidates:
+        return ''
+    if len(candidates) == 1:
+        return candidates[0][2]
+    if latitude is None:
+        return ''  # several zones and nothing to choose by
+    scale = math.cos(math.radians(latitude))
+    return min(candidates, key=lambda z: (z[0] - latitude) ** 2 + ((z[1] - longitude) * scale) ** 2)[2]
+
+
+def _float(value: str):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def convert(source: str, output: str, level: str = 'city', tz_dir: str = None):
+    countries, zones = load_tz_tables(tz_dir)
+    opener = gzip.open if source.endswith('.gz') else open
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    zone_cache = {}
+    written = read = 0
+    pending = None  # [start, end, location], extended while ranges stay contiguous
+
+    with opener(source, 'rt', newline='', encoding='utf-8') as f, \
+            gzip.open(output, 'wt', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        writer.writerow(['ip_start', 'ip_end', 'country_code', 'country', 'region', 'city', 'timezone'])
+        for row in csv.reader(f):
+            if len(row) < 6:
+                continue
+            read += 1
+            try:
+                start, end = ipaddress.ip_address(row[0]), ipaddress.ip_address(row[1])
+            except ValueError:
+                continue
+            code = row[3].upper()
+            if code in ('', 'ZZ'):
+                continue
+            region, city = (row[4], row[5]) if level == 'city' else ('', '')
+            latitude = _float(row[6]) if level == 'city' and len(row) > 7 else None
+            longitude = _float(row[7]) if level == 'city' and len(row) > 7 else None
+            zone_key = (code, latitude, longitude)
+            zone = zone_cache.get(zone_key)
+            if zone is None:
+                zone = zone_cache[zone_key] = nearest_zone(zones, code, latitude, longitude)
+                if len(zone_cache) > 100000:
+                    zone_cache.clear()
+            location = (code, countries.get(code, code), region, city, zone)
+            if (pending and pending[2] == location and pending[1].version == start.version
+                    and int(pending[1]) + 1 == int(start)):
+                pending[1] = end
+                continue
+            if pending:
+                writer.writerow([pending[0], pending[1], *pending[2]])
+                written += 1
+            pending = [start, end, location]
+        if pending:
+            writer.writerow([pending[0], pending[1], *pending[2]])
+            written += 1
+    print(f"Read {read} ranges, wrote {written} to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('source', help='dbip-city-lite-YYYY-MM.csv(.gz)')
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--level', choices=('city', 'country'), default='city',
+                        help='country drops region/city and merges ranges, for a much smaller table')
+    parser.add_argument('--tz-dir', help='directory holding iso3166.tab and zone.tab')
+    args = parser.parse_args()
+    convert(args.source, args.output, args.level, args.tz_dir)
+
+
+if __name__ == '__main__':
+    main()
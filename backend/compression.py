@@ -0,0 +1,86 @@
+import gzip
+import os
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Response compression. Only complete bodies of at least MIN_SIZE bytes are
+# compressed; streamed responses (NDJSON, SSE) pass through untouched so
+# events are never held back in a compressor buffer. Brotli is preferred when
+# the client accepts it and the package is installed, else gzip.
+
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '4'))
+
+STREAM_TYPES = (b'text/event-stream', b'application/x-ndjson')
+
+
+def _accepted(headers) -> set:
+    for name, value in headers:
+        if name == b'accept-encoding':
+            return {part.split(b';')[0].strip() for part in value.lower().split(b',')}
+    return set()
+
+
+def _compress(body: bytes, encoding: bytes) -> bytes:
+    if encoding == b'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        accepted = _accepted(scope['headers'])
+        if BROTLI_AVAILABLE and b'br' in accepted:
+            encoding = b'br'
+        elif b'gzip' in accepted:
+            encoding = b'gzip'
+        else:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start, passthrough
+            if message['type'] == 'http.response.start':
+                headers = dict(message.get('headers', []))
+                content_type = headers.get(b'content-type', b'')
+                if b'content-encoding' in headers or content_type.startswith(STREAM_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message  # held until we know whether the body is complete
+                return
+            if passthrough or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            passthrough = True
+            if message.get('more_body', False) or len(body) < self.minimum_size:
+                # Streamed or small: send as is
+                await send(start)
+                await send(message)
+                return
+            compressed = _compress(body, encoding)
+            headers = [(k, v) for k, v in start.get('headers', []) if k != b'content-length']
+            headers += [
+                (b'content-encoding', encoding),
+                (b'content-length', str(len(compressed)).encode()),
+                (b'vary', b'Accept-Encoding'),
+            ]
+            await send({**start, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': compressed})
+
+        await self.app(scope, receive, compressing_send)
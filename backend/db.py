@@ -1 +1,452 @@
+import asyncio
+import copy
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from services import metrics
 
+# Data access for Firestore. The Admin SDK client is synchronous, so every
+# call runs on a bounded thread pool instead of the event loop. Concurrent
+# reads issued in the same loop tick are merged into one get_all() and
+# concurrent writes into one batched commit. If a merged call fails, its items
+# are retried one at a time so the failure only reaches the caller it belongs to.
+
+MAX_WORKERS = int(os.environ.get('DB_MAX_WORKERS', '8'))
+MAX_BATCH = 500  # Firestore limit for both get_all and batched writes
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '300'))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+DEFAULT_CREDENTIALS_FILE = 'hubapp-acfaa-firebase-adminsdk-fbsvc-7d17c00386.json'
+# Deferred saves (set_doc_later) are flushed this long after the first one buffered
+WRITE_BEHIND_DELAY = float(os.environ.get('DB_WRITE_BEHIND_DELAY', '2.0'))
+WRITE_BEHIND_ATTEMPTS = int(os.environ.get('DB_WRITE_BEHIND_ATTEMPTS', '5'))
+MAX_PARKED = 1000
+
+
+class Minimum:
+    """Field transform: store min(existing, value); sets value if the field is absent."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class FirestoreBackend:
+    def __init__(self, client):
+        self.client = client
+
+    def get_many(self, keys):
+        refs = [self.client.collection(collection).document(doc_id) for collection, doc_id in keys]
+        found = {}
+        for snapshot in self.client.get_all(refs):
+            if snapshot.exists:
+                found[(snapshot.reference.parent.id, snapshot.id)] = snapshot.to_dict()
+        return {key: found.get(key) for key in keys}
+
+    def commit(self, writes):
+        from firebase_admin import firestore
+
+        batch = self.client.batch()
+        for collection, doc_id, data, merge in writes:
+            data = {key: firestore.Minimum(value.value) if isinstance(value, Minimum) else value
+                    for key, value in data.items()}
+            batch.set(self.client.collection(collection).document(doc_id), data, merge=merge)
+        batch.commit()
+
+
+class MemoryBackend:
+    """In-process stand-in for Firestore, for tests and local benchmarks."""
+
+    def __init__(self):
+        self.collections = {}
+        self.reads = 0
+        self.commits = 0
+
+    def get_many(self, keys):
+        self.reads += 1
+        result = {}
+        for collection, doc_id in keys:
+            doc = self.collections.get(collection, {}).get(doc_id)
+            result[(collection, doc_id)] = copy.deepcopy(doc) if doc is not None else None
+        return result
+
+    def commit(self, writes):
+        self.commits += 1
+        for collection, doc_id, data, merge in writes:
+            docs = self.collections.setdefault(collection, {})
+            existing = docs.get(doc_id) if merge else None
+            data = {key: _apply_transform(value, (existing or {}).get(key)) for key, value in data.items()}
+            if existing is not None:
+                _merge_into(existing, copy.deepcopy(data))
+            else:
+                docs[doc_id] = copy.deepcopy(data)
+
+
+def _apply_transform(value, current):
+    if isinstance(value, Minimum):
+        if isinstance(current, (int, float)):
+            return min(current, value.value)
+        return value.value
+    return value
+
+
+def _merge_into(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value)
+        else:
+            target[key] = value
+
+
+def _credentials_path():
+    path = os.environ.get('FIREBASE_CREDENTIALS') or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    if path:
+        return path
+    # Historical location at the repo root, resolved independently of the working directory
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', DEFAULT_CREDENTIALS_FILE)
+
+
+def _firestore_backend():
+    from firebase_admin import credentials, firestore, initialize_app
+    import firebase_admin
+
+    # Initialize Firebase Admin SDK if not already initialized
+    try:
+        if not firebase_admin._apps:
+            if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+                # The emulator needs no credentials, only a project id
+                initialize_app(options={'projectId': os.environ.get('GOOGLE_CLOUD_PROJECT', 'hubapp-local')})
+            else:
+                initialize_app(credentials.Certificate(_credentials_path()))
+    except Exception as e:
+        print(f"Firebase initialization error: {e}")
+        return None
+
+    # Get Firestore client
+    try:
+        return FirestoreBackend(firestore.client())
+    except Exception as e:
+        print(f"Firestore client error: {e}")
+        return None
+
+
+class _Batcher:
+    """Collects requests made during one loop tick and runs them as one call."""
+
+    def __init__(self, run, operation: str):
+        self._run = run
+        self.operation = operation
+        self._pending = []
+        self._scheduled = False
+        self._tasks = set()
+
+    def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._start_flush)
+        return future
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self._flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self):
+        pending, self._pending = self._pending, []
+        self._scheduled = False
+        for start in range(0, len(pending), MAX_BATCH):
+            chunk = pending[start:start + MAX_BATCH]
+            started = time.perf_counter()
+            try:
+                results = await _offload(self._run, [item for item, _ in chunk])
+            except Exception as e:
+                metrics.observe_db(self.operation, started, len(chunk), failed=True)
+                if len(chunk) == 1:
+                    _resolve(chunk[0][1], error=e)
+                    continue
+                # The items come from unrelated callers; one bad document
+                # must not fail everyone else's, so retry them one by one
+                await asyncio.gather(*(self._run_one(item, future) for item, future in chunk))
+                continue
+            metrics.observe_db(self.operation, started, len(chunk))
+            for item, future in chunk:
+                _resolve(future, results.get(item) if isinstance(results, dict) else None)
+
+    async def _run_one(self, item, future):
+        started = time.perf_counter()
+        try:
+            results = await _offload(self._run, [item])
+        except Exception as e:
+            metrics.observe_db(self.operation, started, 1, failed=True)
+            _resolve(future, error=e)
+            return
+        metrics.observe_db(self.operation, started, 1)
+        _resolve(future, results.get(item) if isinstance(results, dict) else None)
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='db')
+# Set up by init() from the app lifespan, in each worker process: nothing
+# touches Firebase at import time, and forked workers never share a client.
+backend = None
+state = 'pending'
+
+
+async def _offload(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+def _read(keys):
+    return backend.get_many(list(dict.fromkeys(keys)))
+
+
+def _write(writes):
+    backend.commit(writes)
+
+
+_reads = _Batcher(_read, 'read')
+_writes = _Batcher(_write, 'commit')
+
+
+def init():
+    """Create the storage backend for this process (blocking; run off the loop)."""
+    global backend, state
+    if state == 'ready':
+        return backend
+    started = time.perf_counter()
+    backend = MemoryBackend() if os.environ.get('DB_BACKEND') == 'memory' else _firestore_backend()
+    state = 'ready' if backend is not None else 'unavailable'
+    print(f"Database {state} after {time.perf_counter() - started:.2f}s")
+    return backend
+
+
+def available() -> bool:
+    return backend is not None
+
+
+def use_backend(new_backend):
+    # Swap the storage backend (e.g. MemoryBackend for tests/benchmarks)
+    global backend, state
+    backend = new_backend
+    state = 'ready' if new_backend is not None else 'unavailable'
+
+
+async def get_doc(collection: str, doc_id: str):
+    """Return the document as a dict, or None if it does not exist."""
+    buffered = _deferred.get((collection, doc_id))
+    if buffered is not None:
+        # Read-your-writes for saves that haven't been flushed yet
+        return copy.deepcopy(buffered)
+    started = time.perf_counter()
+    doc = await _reads.submit((collection, doc_id))
+    metrics.span('db', f"read {collection}", started)
+    # Several waiters may share one read; give each its own copy
+    return copy.deepcopy(doc) if doc is not None else None
+
+
+async def get_docs(keys):
+    """Fetch several (collection, doc_id) documents with a single get_all()."""
+    docs = await asyncio.gather(*(get_doc(collection, doc_id) for collection, doc_id in keys))
+    return dict(zip(keys, docs))
+
+
+async def set_doc(collection: str, doc_id: str, data: dict, merge: bool = False):
+    started = time.perf_counter()
+    await _writes.submit((collection, doc_id, data, merge))
+    metrics.span('db', f"write {collection}", started)
+
+
+async def set_docs(writes):
+    """Write (collection, doc_id, data, merge) tuples in one batched commit."""
+    await asyncio.gather(*(set_doc(*write) for write in writes))
+
+
+# === WRITE-BEHIND ===
+# Full-document saves that are rewritten constantly (dashboard layout on every
+# drag, session state) are buffered per document and committed together
+# WRITE_BEHIND_DELAY seconds after the first one. Repeated saves of the same
+# document inside that window collapse into one write of the latest value.
+# Reads in this process see buffered values; other worker processes see them
+# once flushed. Each document succeeds or fails on its own: a failed one is
+# retried on the next window unless a newer save has replaced it, and after
+# WRITE_BEHIND_ATTEMPTS failures in a row it is parked (logged, counted, kept
+# for inspection) instead of being retried forever.
+
+class _WriteBehind:
+    def __init__(self, delay: float = WRITE_BEHIND_DELAY):
+        self.delay = delay
+        self._pending = {}
+        self._flushing = {}
+        self._attempts = {}  # key -> consecutive failed flushes of the buffered value
+        self.parked = OrderedDict()  # key -> (data, error) given up on
+        self._timer = None
+        self._lock = None
+        self._tasks = set()
+        self.buffered = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.failed = 0
+        self.parked_total = 0
+
+    def get(self, key):
+        value = self._pending.get(key)
+        return value if value is not None else self._flushing.get(key)
+
+    def put(self, key, data: dict):
+        if key in self._pending:
+            self.coalesced += 1
+        # A new value gets a fresh set of attempts
+        self._attempts.pop(key, None)
+        self.parked.pop(key, None)
+        self._buffer(key, data)
+        self.buffered += 1
+
+    def _buffer(self, key, data):
+        self._pending[key] = copy.deepcopy(data)
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        # One flush at a time, so an older value can never be committed after a newer one
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+            try:
+                results = await asyncio.gather(
+                    *(set_doc(collection, doc_id, data) for (collection, doc_id), data in batch.items()),
+                    return_exceptions=True,
+                )
+            finally:
+                self._flushing = {}
+            for (key, data), result in zip(batch.items(), results):
+                if not isinstance(result, Exception):
+                    self.flushed += 1
+                    if key not in self._pending:
+                        self._attempts.pop(key, None)
+                    continue
+                self.failed += 1
+                if key in self._pending:
+                    continue  # superseded by a newer save, which gets its own attempts
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts < WRITE_BEHIND_ATTEMPTS:
+                    self._attempts[key] = attempts
+                    self._buffer(key, data)
+                else:
+                    self._park(key, data, result)
+
+    def _park(self, key, data, error):
+        self._attempts.pop(key, None)
+        self.parked[key] = (data, repr(error))
+        self.parked_total += 1
+        while len(self.parked) > MAX_PARKED:
+            self.parked.popitem(last=False)
+        print(f"Giving up on deferred write {key[0]}/{key[1]} after {WRITE_BEHIND_ATTEMPTS} attempts: {error}")
+
+    async def drain(self):
+        """Flush everything still buffered; called on shutdown."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+        if self._timer is not None:
+            # The final flush failed and re-buffered; nothing will run it now
+            self._timer.cancel()
+            self._timer = None
+            print(f"Dropping {len(self._pending)} unsaved deferred writes on shutdown")
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'flushing': len(self._flushing),
+            'buffered': self.buffered,
+            'coalesced': self.coalesced,
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'parked': len(self.parked),
+            'parked_total': self.parked_total,
+        }
+
+
+_deferred = _WriteBehind()
+
+
+def set_doc_later(collection: str, doc_id: str, data: dict):
+    """Replace a document via the write-behind buffer; returns immediately."""
+    _deferred.put((collection, doc_id), data)
+
+
+async def flush_writes():
+    await _deferred.drain()
+
+
+def write_stats():
+    return _deferred.stats()
+
+
+# === USERS ===
+# Write-through cache of users/{id}. Entries expire after USER_CACHE_TTL so
+# other worker processes' writes become visible eventually.
+_users = OrderedDict()
+
+
+def _cache_user(user_id: str, doc):
+    _users[user_id] = (time.monotonic() + USER_CACHE_TTL, doc)
+    _users.move_to_end(user_id)
+    while len(_users) > USER_CACHE_SIZE:
+        _users.popitem(last=False)
+
+
+def invalidate_user(user_id: str):
+    _users.pop(user_id, None)
+
+
+async def get_user(user_id: str):
+    cached = _users.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        _users.move_to_end(user_id)
+        return copy.deepcopy(cached[1])
+    doc = await get_doc('users', user_id)
+    _cache_user(user_id, doc)
+    return copy.deepcopy(doc)
+
+
+async def save_login(user_id: str, data: dict, now_ms: int):
+    """Upsert the user on login with a single write and no read.
+
+    created_at_ms uses a Minimum transform, so it is set on the first login and
+    left alone afterwards.
+    """
+    await set_doc('users', user_id, {**data, 'created_at_ms': Minimum(now_ms)}, merge=True)
+    cached = _users.get(user_id)
+    if cached is not None:
+        doc = cached[1] or {}
+        doc.update(copy.deepcopy(data))
+        doc.setdefault('created_at_ms', now_ms)
+        _cache_user(user_id, doc)
+
+
+async def update_user(user_id: str, data: dict):
+    await set_doc('users', user_id, data, merge=True)
+    invalidate_user(user_id)
@@ -0,0 +1,25 @@
+# gunicorn -c gunicorn.conf.py main:app   (from backend/; needs `pip install gunicorn`)
+#
+# The app is not preloaded: each worker imports it and runs the lifespan
+# itself, so Firebase, the HTTP pools and the caches are created per process
+# after the fork. Import is cheap, which keeps worker (re)starts fast.
+import os
+from dotenv import load_dotenv
+from start import available_cpus
+
+# Before anything below (or a worker importing the app) reads settings
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WORKERS') or os.environ.get('WEB_CONCURRENCY') or available_cpus())
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = False
+keepalive = 5
+timeout = int(os.environ.get('WORKER_TIMEOUT', '60'))
+# Long enough for pending deferred writes to flush on shutdown
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', '20'))
+# Recycle workers now and then; the jitter keeps them from restarting together
+max_requests = int(os.environ.get('MAX_REQUESTS', '0'))
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+accesslog = os.environ.get('ACCESS_LOG')  # e.g. '-' for stdout
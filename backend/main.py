@@ -1,14 +1,117 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file. This has to happen before the
+# app modules are imported: they read their settings at import time.
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-import os
-from dotenv import load_dotenv
 from routes import router
+import auth
+import db
+from compression import CompressionMiddleware
+from services.cache import response_cache
+from services import geo, metrics, policy
+from services.clients import registry
+from services.scheduler import scheduler
+from services.singleflight import flights
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything here runs once per worker process, after any fork, so
+    # workers never share sockets or Firebase clients and imports stay cheap.
+    app.state.ready = False
+    # Shared HTTP connection pools for all provider calls (warmed in the background)
+    await registry.start()
+    # Auth0 signing keys, refreshed in the background
+    auth.start()
+    # Firebase/Firestore client and the offline IP geolocation table are
+    # blocking to set up: both run off the event loop, side by side
+    await asyncio.gather(asyncio.to_thread(db.init), asyncio.to_thread(geo.load))
+    # Keeps active users' provider data warm ahead of cache expiry
+    scheduler.start()
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        # Fail readiness first so load balancers stop sending traffic
+        app.state.ready = False
+        await scheduler.stop()
+        # Deferred layout/session saves must reach Firestore before exit
+        await db.flush_writes()
+        await auth.stop()
+        await registry.close()
+
+
+class TimingMiddleware:
+    """Records latency, status and response size per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        trace = metrics.start_trace()
+        response = {'status': 500, 'size': 0}
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+            await send(message)
 
-# Load environment variables from .env file
-load_dotenv()
+        failed = True
+        try:
+            await self.app(scope, receive, timed_send)
+            failed = response['status'] >= 500
+        finally:
+            # Label by route template (/x/{id}), not the raw path, to bound cardinality
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            elapsed = metrics.observe_request(route, scope['method'], response['status'], started,
+                                              response['size'], failed)
+            metrics.finish_trace(trace, route, scope['method'], response['status'], elapsed)
 
-app = FastAPI()
+
+def _pool_connections():
+    return {(provider, state): stats.get(state, 0)
+            for provider, stats in registry.stats().items() for state in ('active', 'idle', 'queued')}
+
+
+metrics.registry.register(metrics.Gauge(
+    'hub_upstream_pool_connections', 'Pooled upstream connections by state', ('provider', 'state'),
+    _pool_connections))
+metrics.registry.register(metrics.Gauge(
+    'hub_upstream_circuit_open', '1 while the provider circuit breaker is not closed', ('provider',),
+    lambda: {(p,): int(s['state'] != 'closed') for p, s in policy.stats().items()}))
+metrics.registry.register(metrics.Gauge(
+    'hub_cache_entries', 'Response cache entries', (), lambda: {(): response_cache.stats()['entries']}))
+metrics.registry.register(metrics.Gauge(
+    'hub_cache_bytes', 'Response cache size in bytes', (), lambda: {(): response_cache.stats()['bytes']}))
+metrics.registry.register(metrics.Gauge(
+    'hub_cache_hit_ratio', 'Response cache hits / lookups since start', (),
+    lambda: {(): response_cache.stats()['hit_ratio']}))
+metrics.registry.register(metrics.Gauge(
+    'hub_singleflight_calls', 'Upstream calls started vs. collapsed onto an in-flight one', ('result',),
+    lambda: {('started',): flights.started, ('collapsed',): flights.collapsed}))
+metrics.registry.register(metrics.Gauge(
+    'hub_db_deferred_writes', 'Deferred document saves by state', ('state',),
+    lambda: {(k,): v for k, v in db.write_stats().items()}))
+metrics.registry.register(metrics.Gauge(
+    'hub_scheduler_queued', 'Users waiting for a background refresh', (),
+    lambda: {(): scheduler.stats()['queued']}))
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(SessionMiddleware, secret_key=os.environ.get('SESSION_SECRET', 'supersecret'))
 app.add_middleware(
     CORSMiddleware,
@@ -17,6 +120,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+# Outermost, so it sees the compressed size that goes on the wire
+app.add_middleware(TimingMiddleware)
 
 # Include all modular API routes
 app.include_router(router)
@@ -28,4 +134,45 @@ app.include_router(router)
 
 @app.get("/health")
 def health():
-    return {"status": "ok"} 
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    # Readiness, unlike /health (liveness): startup finished, the database
+    # client exists and the pools are up. Pool warm-up is reported, not required.
+    checks = {
+        'startup': 'done' if getattr(app.state, 'ready', False) else 'pending',
+        'db': db.state,
+        'pools': 'started' if registry.started else 'pending',
+    }
+    is_ready = checks['startup'] == 'done' and checks['db'] == 'ready' and checks['pools'] == 'started'
+    body = {'ready': is_ready, 'checks': checks, 'warmup': registry.warmup, 'pid': os.getpid()}
+    return ORJSONResponse(body, status_code=200 if is_ready else 503)
+
+@app.get("/health/pools")
+def pool_stats():
+    return registry.stats()
+
+@app.get("/health/cache")
+def cache_stats():
+    return {**response_cache.stats(), 'singleflight': flights.stats()}
+
+@app.get("/health/scheduler")
+def scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/health/upstreams")
+def upstream_stats():
+    return policy.stats()
+
+@app.get("/health/db")
+def db_stats():
+    return {'available': db.available(), 'deferred_writes': db.write_stats()}
+
+@app.get("/health/slow")
+def slow_requests():
+    return list(metrics.slow_requests)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4')
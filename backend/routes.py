@@ -1,34 +1,41 @@
 from fastapi import APIRouter, Request, Response, HTTPException
-from fastapi.responses import RedirectResponse, JSONResponse
+import asyncio
+import json
+from fastapi.responses import ORJSONResponse, RedirectResponse, JSONResponse, StreamingResponse
 import os
+import time
 import httpx
 from services import google, microsoft, github
-import jwt
-from fastapi import Body
-from datetime import datetime
-from firebase_admin import credentials, firestore, initialize_app
-import firebase_admin
-
-# Initialize Firebase Admin SDK if not already initialized
-try:
-    if not firebase_admin._apps:
-        cred = credentials.Certificate('../hubapp-acfaa-firebase-adminsdk-fbsvc-7d17c00386.json')
-        firebase_admin_initialized = initialize_app(cred)
-    else:
-        firebase_admin_initialized = firebase_admin.get_app()
-except Exception as e:
-    print(f"Firebase initialization error: {e}")
-    firebase_admin_initialized = None
-
-# Get Firestore client
-try:
-    db = firestore.client()
-except Exception as e:
-    print(f"Firestore client error: {e}")
-    db = None
+from services import fanout, geo, messages, search, sync, timeline
+from services.projection import parse_fields, project
+from services.changes import feed
+from services.scheduler import scheduler
+from services.cache import response_cache
+from services.clients import fetch, token_key
+from services.policy import ProviderUnavailable
+from fastapi import Body, Depends, Query
+from datetime import datetime, timezone
+import auth
+import db
 
 router = APIRouter()
 
+# /dashboard budget: the whole page must answer within DASHBOARD_DEADLINE seconds,
+# each upstream gets its own (shorter) timeout
+DASHBOARD_DEADLINE = float(os.environ.get('DASHBOARD_DEADLINE', '4.0'))
+PROVIDER_TIMEOUTS = {
+    'google': float(os.environ.get('GOOGLE_TIMEOUT', '3.0')),
+    'microsoft': float(os.environ.get('MICROSOFT_TIMEOUT', '3.0')),
+    'github': float(os.environ.get('GITHUB_TIMEOUT', '3.0')),
+    'firestore': float(os.environ.get('FIRESTORE_TIMEOUT', '2.0')),
+}
+
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', '25'))
+STREAM_RETRY_MS = 5000
+
+# ?fields= on /dashboard and the provider routes (services/projection.py)
+FIELDS_HELP = "Comma-separated dotted paths to keep, e.g. items.id,items.summary"
+
 # === AUTH0 CONFIG ===
 # Note: We'll get these at runtime instead of module load time
 def get_auth0_config():
@@ -57,8 +64,23 @@ def login(request: Request, connection: str = None):
         
     return RedirectResponse(auth_url)
 
+def _forget_user(access_token: str):
+    # Drop everything this process keeps for the user's token
+    user_key = token_key(access_token)
+    scheduler.forget(user_key)
+    response_cache.invalidate_user(user_key)
+    fanout.forget(user_key)
+    fanout.forget(('timeline', user_key))
+    sync.store.drop_user(user_key)
+    messages.forget_user(access_token)
+    timeline.drop(user_key)
+    search.index.drop(user_key)
+
 @router.get('/auth/logout')
 async def logout(request: Request):
+    access_token = request.cookies.get('access_token')
+    if access_token:
+        _forget_user(access_token)
     frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
     response = RedirectResponse(url=f'{frontend_url}')
     # Clear authentication cookies
@@ -87,49 +109,44 @@ async def auth_callback(request: Request, code: str = None, error: str = None, e
         'code': code,
         'redirect_uri': config['AUTH0_CALLBACK_URL'],
     }
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(token_url, data=data)
-        if resp.status_code != 200:
-            raise HTTPException(status_code=400, detail='Auth0 token exchange failed')
-        tokens = resp.json()
+    try:
+        resp = await fetch('auth0', token_url, method='POST', data=data)
+    except ProviderUnavailable:
+        raise HTTPException(status_code=503, detail='Auth0 is temporarily unavailable')
+    if resp.status_code != 200:
+        raise HTTPException(status_code=400, detail='Auth0 token exchange failed')
+    tokens = resp.json()
     # You can decode the id_token for user info
     id_token = tokens.get('id_token')
     access_token = tokens.get('access_token')
     
     # Store user data in database
-    if id_token and db:
+    if id_token and db.available():
         try:
-            # Decode the ID token to get user info
-            payload = jwt.decode(id_token, options={"verify_signature": False})
+            # Verify the ID token to get user info
+            payload = await auth.verify(id_token)
             user_id = payload.get('sub')
             
             if user_id:
                 # Store/update user data
                 now = datetime.utcnow().isoformat()
                 user_data = {
-                    'id': user_id,
-                    'email': payload.get('email', ''),
-                    'name': payload.get('name', ''),
-                    'picture': payload.get('picture', ''),
-                    'firstName': payload.get('given_name', payload.get('name', '').split(' ')[0] if payload.get('name') else ''),
-                    'lastName': payload.get('family_name', payload.get('name', '').split(' ')[-1] if payload.get('name') and ' ' in payload.get('name') else ''),
+                    **auth.user_from_claims(payload),
                     'last_login': now,
                     'updated_at': now
                 }
                 
-                # Check if user exists to preserve created_at
-                doc_ref = db.collection('users').document(user_id)
-                doc = doc_ref.get()
-                if not doc.exists:
-                    # New user, set created_at
-                    user_data['created_at'] = now
-                
-                doc_ref = db.collection('users').document(user_id)
-                doc_ref.set(user_data, merge=True)
+                # One write, no read: created_at_ms is only set for new users
+                await db.save_login(user_id, user_data, int(time.time() * 1000))
                 print(f"User {user_id} data stored/updated successfully")
         except Exception as e:
             print(f"Error storing user data: {e}")
     
+    # A new login replaces the token; nothing keyed by the old one is used again
+    previous_token = request.cookies.get('access_token')
+    if previous_token and previous_token != access_token:
+        _forget_user(previous_token)
+
     # Set session cookie (for demo, return tokens)
     # Redirect to frontend dashboard page
     frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
@@ -138,149 +155,273 @@ async def auth_callback(request: Request, code: str = None, error: str = None, e
     response.set_cookie('access_token', access_token, httponly=True, secure=False, samesite='lax')
     return response
 
+def respond(data, fields: str = None):
+    # Upstream payloads are plain JSON already: skip FastAPI's encoder pass and
+    # trim to the requested fields before serializing
+    return ORJSONResponse(project(data, parse_fields(fields)))
+
 @router.get('/dashboard')
-async def dashboard(request: Request):
+async def dashboard(request: Request, claims: dict = Depends(auth.optional_claims),
+                    fields: str = Query(None, description=FIELDS_HELP)):
     # Aggregate user data from all services (stub: expects access_token in cookie)
     access_token = request.cookies.get('access_token')
-    id_token = request.cookies.get('id_token')
     if not access_token:
         raise HTTPException(status_code=401, detail='Not authenticated')
     
-    # Get user data
-    user_data = None
-    if id_token:
+    # Basic user data from token
+    user_data = auth.user_from_claims(claims) if claims else None
+    user_id = user_data['id'] if user_data else None
+
+    # Keep this user's provider data pre-warmed while they are active
+    scheduler.touch(token_key(access_token), access_token)
+
+    # Fetch the stored user document and all services concurrently within one deadline
+    calls = {
+        'google': fanout.Call(google.get_calendar_events, access_token,
+                              timeout=PROVIDER_TIMEOUTS['google'], fallback={'items': []}),
+        'microsoft': fanout.Call(microsoft.get_calendar_events, access_token,
+                                 timeout=PROVIDER_TIMEOUTS['microsoft'], fallback={'value': []}),
+        'github': fanout.Call(github.get_profile, access_token,
+                              timeout=PROVIDER_TIMEOUTS['github'],
+                              fallback={'profile': {'name': 'Unknown', 'email': 'unknown@example.com'}}),
+    }
+    if db.available() and user_id:
+        calls['user'] = fanout.Call(db.get_user, user_id,
+                                    timeout=PROVIDER_TIMEOUTS['firestore'], stale=False)
+    results = await fanout.fan_out(calls, scope=token_key(access_token), deadline=DASHBOARD_DEADLINE)
+
+    user_key = token_key(access_token)
+    feed.observe(user_key, 'google_calendar', results['google'])
+    feed.observe(user_key, 'ms_calendar', results['microsoft'])
+    feed.observe(user_key, 'github', results['github'])
+
+    stored_data = results.get('user')
+    if user_data is not None and isinstance(stored_data, dict):
+        user_data.update(stored_data)
+
+    return respond({
+        'user': user_data,
+        'google': results['google'],
+        'microsoft': results['microsoft'],
+        'github': results['github']
+    }, fields)
+
+def stream_items(items, format: str = 'ndjson'):
+    # Forward items from an async generator as NDJSON lines or SSE events.
+    # The 200 has gone out with the first item, so a failure part way through
+    # becomes a final error record instead of a truncated body.
+    async def body():
         try:
-            payload = jwt.decode(id_token, options={"verify_signature": False})
-            user_id = payload.get('sub')
-            
-            # Basic user data from token
-            user_data = {
-                'id': user_id,
-                'email': payload.get('email', ''),
-                'name': payload.get('name', ''),
-                'picture': payload.get('picture', ''),
-                'firstName': payload.get('given_name', payload.get('name', '').split(' ')[0] if payload.get('name') else ''),
-                'lastName': payload.get('family_name', payload.get('name', '').split(' ')[-1] if payload.get('name') and ' ' in payload.get('name') else '')
-            }
-            
-            # Try to get additional data from database
-            if db and user_id:
+            async for item in items:
+                line = json.dumps(item, separators=(',', ':'))
+                yield f"data: {line}\n\n" if format == 'sse' else line + '\n'
+        except (sync.UpstreamError, httpx.HTTPError, ValueError) as e:
+            if isinstance(e, sync.UpstreamError):
+                payload = e.payload
+            else:
+                # Retries exhausted, or a non-JSON error page
+                print(f"Stream failed: {type(e).__name__}: {e}")
+                payload = {'error': f"{type(e).__name__}: {e}" if str(e) else type(e).__name__}
+            line = json.dumps({'error': payload}, separators=(',', ':'))
+            yield f"event: error\ndata: {line}\n\n" if format == 'sse' else line + '\n'
+        finally:
+            # Stops the page prefetcher when the client goes away
+            await items.aclose()
+        if format == 'sse':
+            yield "event: end\ndata: {}\n\n"
+
+    media_type = 'text/event-stream' if format == 'sse' else 'application/x-ndjson'
+    return StreamingResponse(body(), media_type=media_type, headers={'Cache-Control': 'no-cache'})
+
+@router.get('/dashboard/stream')
+async def dashboard_stream(request: Request):
+    # Server-Sent Events: pushes only what changed in the user's provider data
+    # (see services/changes.py). An idle stream costs one waiting coroutine.
+    access_token = request.cookies.get('access_token')
+    if not access_token:
+        raise HTTPException(status_code=401, detail='Not authenticated')
+    user_key = token_key(access_token)
+    queue = feed.subscribe(user_key)
+    # Open streams get refresh priority for as long as they stay open
+    scheduler.touch(user_key, access_token, online=True)
+
+    async def events():
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            while not await request.is_disconnected():
                 try:
-                    doc_ref = db.collection('users').document(user_id)
-                    doc = doc_ref.get()
-                    if doc.exists:
-                        stored_data = doc.to_dict()
-                        user_data.update(stored_data)
-                except Exception as e:
-                    print(f"Error fetching user from database: {e}")
-        except Exception as e:
-            print(f"Error decoding token: {e}")
-    
-    # Fetch data from services with error handling
-    try:
-        google_data = await google.get_calendar_events(access_token)
-    except Exception as e:
-        google_data = {'error': str(e), 'items': []}
-    
-    try:
-        ms_data = await microsoft.get_calendar_events(access_token)
-    except Exception as e:
-        ms_data = {'error': str(e), 'value': []}
-    
-    try:
-        github_data = await github.get_profile(access_token)
-    except Exception as e:
-        github_data = {'error': str(e), 'profile': {'name': 'Unknown', 'email': 'unknown@example.com'}}
-    
-    
+                    change = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {change['type']}\ndata: {json.dumps(change, separators=(',', ':'))}\n\n"
+        finally:
+            feed.unsubscribe(user_key, queue)
+            if not feed.watching(user_key):
+                scheduler.set_online(user_key, False)
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@router.get('/timeline')
+async def get_timeline(
+    request: Request,
+    start: datetime = Query(None, alias='from'),
+    end: datetime = Query(None, alias='to'),
+    limit: int = Query(50, ge=1, le=500),
+):
+    # Google and Microsoft events merged into one time-ordered list.
+    # With from/to: events overlapping [from, to); otherwise the next `limit` upcoming.
+    access_token = request.cookies.get('access_token')
+    if not access_token:
+        raise HTTPException(status_code=401, detail='Not authenticated')
+
+    index, sources = await _timeline_index(access_token)
+
+    now = datetime.now(timezone.utc)
+    if start or end:
+        start_ts = _as_utc(start or now).timestamp()
+        end_ts = _as_utc(end).timestamp() if end else float('inf')
+        events = index.between(start_ts, end_ts, limit)
+    else:
+        events = index.upcoming(now.timestamp(), limit)
+
     return {
-        'user': user_data,
-        'google': google_data,
-        'microsoft': ms_data,
-        'github': github_data
+        'events': [event.to_dict() for event in events],
+        'sources': sources,
+    }
+
+@router.get('/meetings/upcoming')
+async def upcoming_meetings(request: Request, limit: int = Query(10, ge=1, le=100)):
+    # Join links for both providers, taken from the same synced calendars as the timeline
+    access_token = request.cookies.get('access_token')
+    if not access_token:
+        raise HTTPException(status_code=401, detail='Not authenticated')
+
+    index, sources = await _timeline_index(access_token)
+    meetings = []
+    for event in index.upcoming(datetime.now(timezone.utc).timestamp(), len(index)):
+        if event.join_url:
+            meetings.append(event.to_dict())
+            if len(meetings) >= limit:
+                break
+    return {'meetings': meetings, 'sources': sources}
+
+async def _timeline_index(access_token: str):
+    scheduler.touch(token_key(access_token), access_token)
+    calls = {
+        'google': fanout.Call(google.calendar_state, access_token,
+                              timeout=PROVIDER_TIMEOUTS['google'], expects=sync.SyncState),
+        'microsoft': fanout.Call(microsoft.calendar_state, access_token,
+                                 timeout=PROVIDER_TIMEOUTS['microsoft'], expects=sync.SyncState),
+    }
+    # Its own scope: /dashboard keeps differently shaped last good values under the same names
+    results = await fanout.fan_out(calls, scope=('timeline', token_key(access_token)), deadline=DASHBOARD_DEADLINE)
+    index = timeline.index_for(token_key(access_token), results['google'], results['microsoft'])
+    sources = {name: 'ok' if value is not None else 'unavailable' for name, value in results.items()}
+    return index, sources
+
+@router.get('/search')
+async def search_items(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    kinds: str = Query(None, description="Comma-separated: gmail,outlook,google_calendar,ms_calendar,github"),
+):
+    # Answered from the in-process index of already-fetched data (services/search.py);
+    # never goes upstream
+    access_token = request.cookies.get('access_token')
+    if not access_token:
+        raise HTTPException(status_code=401, detail='Not authenticated')
+    user_key = token_key(access_token)
+    # Keep the data behind the index fresh for the next query
+    scheduler.touch(user_key, access_token)
+    started = time.perf_counter()
+    results, indexed = search.index.search(user_key, q, limit, set(kinds.split(',')) if kinds else None)
+    return {
+        'query': q,
+        'results': results,
+        'indexed': indexed,
+        'took_ms': round((time.perf_counter() - started) * 1000, 3),
     }
 
+def _as_utc(value: datetime):
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
 @router.get('/google/gmail')
-async def gmail(token: str):
-    return await google.get_gmail_messages(token)
+async def gmail(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await google.get_gmail_messages(token), fields)
+
+@router.get('/google/gmail/stream')
+async def gmail_stream(token: str, format: str = 'ndjson'):
+    return stream_items(google.iter_gmail_messages(token), format)
 
 @router.get('/google/calendar')
-async def google_calendar(token: str):
-    return await google.get_calendar_events(token)
+async def google_calendar(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await google.get_calendar_events(token), fields)
+
+@router.get('/google/calendar/stream')
+async def google_calendar_stream(token: str, format: str = 'ndjson'):
+    return stream_items(google.iter_calendar_events(token), format)
 
 @router.get('/google/meet')
-async def google_meet(token: str):
-    return await google.get_meet_links(token)
+async def google_meet(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await google.get_meet_links(token), fields)
 
 @router.get('/microsoft/outlook')
-async def outlook(token: str):
-    return await microsoft.get_outlook_messages(token)
+async def outlook(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await microsoft.get_outlook_messages(token), fields)
+
+@router.get('/microsoft/outlook/stream')
+async def outlook_stream(token: str, format: str = 'ndjson'):
+    return stream_items(microsoft.iter_outlook_messages(token), format)
 
 @router.get('/microsoft/calendar')
-async def ms_calendar(token: str):
-    return await microsoft.get_calendar_events(token)
+async def ms_calendar(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await microsoft.get_calendar_events(token), fields)
+
+@router.get('/microsoft/calendar/stream')
+async def ms_calendar_stream(token: str, format: str = 'ndjson'):
+    return stream_items(microsoft.iter_calendar_events(token), format)
 
 @router.get('/microsoft/teams')
-async def ms_teams(token: str):
-    return await microsoft.get_teams_meetings(token)
+async def ms_teams(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await microsoft.get_teams_meetings(token), fields)
 
 
 @router.get('/github/profile')
-async def github_profile(token: str):
-    return await github.get_profile(token)
+async def github_profile(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await github.get_profile(token), fields)
 
 @router.get('/github/email')
-async def github_email(token: str):
-    return await github.get_email(token)
+async def github_email(token: str, fields: str = Query(None, description=FIELDS_HELP)):
+    return respond(await github.get_email(token), fields)
 
 SUPABASE_USER_DATA_TABLE = 'user_data'
 
-# Helper to get user_id from id_token
-def get_user_id_from_token(id_token: str):
-    try:
-        payload = jwt.decode(id_token, options={"verify_signature": False})
-        return payload.get('sub')
-    except Exception:
-        return None
-
 @router.get('/session/data')
-async def get_session_data(request: Request):
-    id_token = request.cookies.get('id_token')
-    if not id_token:
-        raise HTTPException(status_code=401, detail='Not authenticated')
-    user_id = get_user_id_from_token(id_token)
-    if not user_id:
-        raise HTTPException(status_code=401, detail='Invalid token')
-    
-    if not db:
+async def get_session_data(request: Request, user_id: str = Depends(auth.current_user_id)):
+    if not db.available():
         raise HTTPException(status_code=500, detail='Database not available')
     
     try:
-        doc_ref = db.collection('user_data').document(user_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            return doc.to_dict().get('data', {})
+        doc = await db.get_doc('user_data', user_id)
+        if doc is not None:
+            return doc.get('data', {})
         return {}
     except Exception as e:
         print(f"Database error: {e}")
         return {}
 
 @router.post('/session/data')
-async def save_session_data(request: Request, data: dict = Body(...)):
-    id_token = request.cookies.get('id_token')
-    if not id_token:
-        raise HTTPException(status_code=401, detail='Not authenticated')
-    user_id = get_user_id_from_token(id_token)
-    if not user_id:
-        raise HTTPException(status_code=401, detail='Invalid token')
-    
-    if not db:
+async def save_session_data(request: Request, data: dict = Body(...), user_id: str = Depends(auth.current_user_id)):
+    if not db.available():
         raise HTTPException(status_code=500, detail='Database not available')
     
     try:
         now = datetime.utcnow().isoformat()
-        doc_ref = db.collection('user_data').document(user_id)
-        doc_ref.set({
+        # Saved on nearly every state change: buffered and coalesced (db.set_doc_later)
+        db.set_doc_later('user_data', user_id, {
             'data': data,
             'updated_at': now
         })
@@ -290,15 +431,8 @@ async def save_session_data(request: Request, data: dict = Body(...)):
         raise HTTPException(status_code=500, detail='Failed to save data')
 
 @router.get('/dashboard/layout')
-async def get_dashboard_layout(request: Request):
-    id_token = request.cookies.get('id_token')
-    if not id_token:
-        raise HTTPException(status_code=401, detail='Not authenticated')
-    user_id = get_user_id_from_token(id_token)
-    if not user_id:
-        raise HTTPException(status_code=401, detail='Invalid token')
-    
-    if not db:
+async def get_dashboard_layout(request: Request, user_id: str = Depends(auth.current_user_id)):
+    if not db.available():
         # Return default layout if database not available
         return {
             'layout': [
@@ -310,10 +444,9 @@ async def get_dashboard_layout(request: Request):
         }
     
     try:
-        doc_ref = db.collection('dashboard_layouts').document(user_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            return doc.to_dict()
+        doc = await db.get_doc('dashboard_layouts', user_id)
+        if doc is not None:
+            return doc
         return {
             'layout': [
                 { 'i': 'welcome', 'x': 0, 'y': 0, 'w': 3, 'h': 2 },
@@ -334,21 +467,14 @@ async def get_dashboard_layout(request: Request):
         }
 
 @router.post('/dashboard/layout')
-async def save_dashboard_layout(request: Request, data: dict = Body(...)):
-    id_token = request.cookies.get('id_token')
-    if not id_token:
-        raise HTTPException(status_code=401, detail='Not authenticated')
-    user_id = get_user_id_from_token(id_token)
-    if not user_id:
-        raise HTTPException(status_code=401, detail='Invalid token')
-    
-    if not db:
+async def save_dashboard_layout(request: Request, data: dict = Body(...), user_id: str = Depends(auth.current_user_id)):
+    if not db.available():
         return {"success": False, "message": "Database not available"}
     
     try:
         now = datetime.utcnow().isoformat()
-        doc_ref = db.collection('dashboard_layouts').document(user_id)
-        doc_ref.set({
+        # Saved on every drag/resize: buffered and coalesced (db.set_doc_later)
+        db.set_doc_later('dashboard_layouts', user_id, {
             'layout': data.get('layout', []),
             'updated_at': now
         })
@@ -358,88 +484,48 @@ async def save_dashboard_layout(request: Request, data: dict = Body(...)):
         return {"success": False, "message": str(e)}
 
 @router.get('/user/profile')
-async def get_user_profile(request: Request):
-    id_token = request.cookies.get('id_token')
-    if not id_token:
-        raise HTTPException(status_code=401, detail='Not authenticated')
+async def get_user_profile(request: Request, claims: dict = Depends(auth.current_claims)):
+    user_id = claims['sub']
     
-    try:
-        # Decode the ID token to get user info
-        payload = jwt.decode(id_token, options={"verify_signature": False})
-        user_id = payload.get('sub')
-        
-        # Get user data from database if available
-        user_data = {
-            'id': user_id,
-            'email': payload.get('email', ''),
-            'name': payload.get('name', ''),
-            'picture': payload.get('picture', ''),
-            'firstName': payload.get('given_name', payload.get('name', '').split(' ')[0] if payload.get('name') else ''),
-            'lastName': payload.get('family_name', payload.get('name', '').split(' ')[-1] if payload.get('name') and ' ' in payload.get('name') else '')
-        }
-        
-        # Get user's IP location
-        client_ip = request.client.host
-        if client_ip:
-            try:
-                # Use a free IP geolocation API
-                async with httpx.AsyncClient() as client:
-                    # Using ip-api.com (free tier available)
-                    geo_response = await client.get(f'http://ip-api.com/json/{client_ip}')
-                    if geo_response.status_code == 200:
-                        geo_data = geo_response.json()
-                        if geo_data.get('status') == 'success':
-                            user_data['location'] = f"{geo_data.get('city', '')}, {geo_data.get('country', '')}"
-                            user_data['locationDetails'] = {
-                                'city': geo_data.get('city'),
-                                'region': geo_data.get('regionName'),
-                                'country': geo_data.get('country'),
-                                'countryCode': geo_data.get('countryCode'),
-                                'timezone': geo_data.get('timezone')
-                            }
-            except Exception as e:
-                print(f"Error fetching location: {e}")
-        
-        if db:
-            try:
-                doc_ref = db.collection('users').document(user_id)
-                doc = doc_ref.get()
-                if doc.exists:
-                    stored_data = doc.to_dict()
-                    # Preserve the created_at timestamp if it exists
-                    if 'created_at' in stored_data:
-                        user_data['created_at'] = stored_data['created_at']
-                    elif 'last_login' in stored_data:
-                        user_data['created_at'] = stored_data['last_login']
-                    user_data.update(stored_data)
-            except Exception as e:
-                print(f"Error fetching user from database: {e}")
-        
-        return user_data
-    except Exception as e:
-        print(f"Error decoding token: {e}")
-        raise HTTPException(status_code=401, detail='Invalid token')
-
-@router.post('/user/profile')
-async def update_user_profile(request: Request, data: dict = Body(...)):
-    id_token = request.cookies.get('id_token')
-    if not id_token:
-        raise HTTPException(status_code=401, detail='Not authenticated')
+    # Get user data from database if available
+    user_data = auth.user_from_claims(claims)
     
-    user_id = get_user_id_from_token(id_token)
-    if not user_id:
-        raise HTTPException(status_code=401, detail='Invalid token')
+    # Get user's IP location from the local geolocation table (services/geo.py)
+    client_ip = request.client.host if request.client else None
+    if client_ip:
+        details = await geo.locate(client_ip)
+        if details:
+            user_data['location'] = f"{details.get('city') or ''}, {details.get('country') or ''}"
+            user_data['locationDetails'] = dict(details)
     
-    if not db:
+    if db.available():
+        try:
+            stored_data = await db.get_user(user_id)
+            if stored_data is not None:
+                # Preserve the created_at timestamp if it exists
+                if 'created_at' in stored_data:
+                    user_data['created_at'] = stored_data['created_at']
+                elif 'created_at_ms' in stored_data:
+                    user_data['created_at'] = datetime.utcfromtimestamp(stored_data['created_at_ms'] / 1000).isoformat()
+                elif 'last_login' in stored_data:
+                    user_data['created_at'] = stored_data['last_login']
+                user_data.update(stored_data)
+        except Exception as e:
+            print(f"Error fetching user from database: {e}")
+    
+    return user_data
+
+@router.post('/user/profile')
+async def update_user_profile(request: Request, data: dict = Body(...), user_id: str = Depends(auth.current_user_id)):
+    if not db.available():
         return {"success": False, "message": "Database not available"}
     
     try:
         now = datetime.utcnow().isoformat()
-        doc_ref = db.collection('users').document(user_id)
-        doc_ref.set({
+        await db.update_user(user_id, {
             **data,
             'updated_at': now
-        }, merge=True)
+        })
         return {"success": True}
     except Exception as e:
         print(f"Database error: {e}")
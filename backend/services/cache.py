@@ -0,0 +1,100 @@
+import os
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = float(os.environ.get('CACHE_TTL', '60'))
+MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '5000'))
+MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+
+class Entry:
+    __slots__ = ('value', 'etag', 'expires_at', 'size')
+
+    def __init__(self, value, etag, expires_at, size):
+        self.value = value
+        self.etag = etag
+        self.expires_at = expires_at
+        self.size = size
+
+    def fresh(self, now: float = None) -> bool:
+        return (now or time.monotonic()) < self.expires_at
+
+
+class ResponseCache:
+    """Bounded LRU of parsed upstream responses keyed by (user, provider, endpoint).
+
+    Expired entries are kept (until evicted) so their ETag can be used to
+    revalidate. Size is measured as the raw body length, which tracks the
+    parsed size closely enough for a memory ceiling.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, etag: str = None, size: int = 0, ttl: float = None):
+        self.invalidate(key)
+        if size > self.max_bytes:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = Entry(value, etag, time.monotonic() + ttl, size)
+        self._bytes += size
+        self._evict()
+
+    def touch(self, key, ttl: float = None):
+        # Upstream answered 304: keep the body, extend its lifetime
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries.move_to_end(key)
+            self.revalidated += 1
+        return entry
+
+    def invalidate(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate_user(self, user: str):
+        for key in [k for k in self._entries if k[0] == user]:
+            self.invalidate(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache()
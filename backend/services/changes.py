@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+
+# Per-user change feed for live dashboards. Whenever provider data is
+# (re)fetched for a user with an open stream, it is compared with the last
+# snapshot and only the differences are pushed: new/removed message IDs,
+# changed/removed events and changed GitHub profile fields. Users without a
+# subscriber keep no snapshot at all, so idle dashboards cost nothing.
+
+QUEUE_SIZE = int(os.environ.get('CHANGES_QUEUE_SIZE', '100'))
+
+MESSAGE_KINDS = {'gmail': 'messages', 'outlook': 'value'}
+EVENT_KINDS = {'google_calendar': 'items', 'ms_calendar': 'value'}
+
+
+def _event_version(event: dict):
+    return event.get('etag') or event.get('changeKey') or event.get('updated') or \
+        event.get('lastModifiedDateTime') or json.dumps(event, sort_keys=True, default=str)
+
+
+class ChangeFeed:
+    def __init__(self):
+        self._subscribers = {}
+        self._snapshots = {}
+
+    def subscribe(self, user: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._subscribers.setdefault(user, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user]
+            self._snapshots.pop(user, None)
+
+    def watching(self, user: str) -> bool:
+        return user in self._subscribers
+
+    def publish(self, user: str, change: dict):
+        for queue in self._subscribers.get(user, ()):
+            if queue.full():
+                # A client this far behind should just reload the dashboard
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({'type': 'resync'})
+            else:
+                queue.put_nowait(change)
+
+    def observe(self, user: str, kind: str, data):
+        """Diff freshly fetched provider data against the last snapshot."""
+        if user not in self._subscribers or not isinstance(data, dict) or 'error' in data:
+            return
+        snapshots = self._snapshots.setdefault(user, {})
+        previous = snapshots.get(kind)
+
+        if kind in MESSAGE_KINDS:
+            items = {m['id']: m for m in data.get(MESSAGE_KINDS[kind], []) if m.get('id')}
+            snapshots[kind] = set(items)
+            if previous is None:
+                return
+            added = [items[i] for i in items if i not in previous]
+            removed = [i for i in previous if i not in items]
+            if added or removed:
+                self.publish(user, {'type': kind, 'added': added, 'removed': removed})
+
+        elif kind in EVENT_KINDS:
+            items = {e['id']: e for e in data.get(EVENT_KINDS[kind], []) if e.get('id')}
+            snapshots[kind] = {i: _event_version(e) for i, e in items.items()}
+            if previous is None:
+                return
+            changed = [e for i, e in items.items() if previous.get(i) != snapshots[kind][i]]
+            removed = [i for i in previous if i not in items]
+            if changed or removed:
+                self.publish(user, {'type': kind, 'changed': changed, 'removed': removed})
+
+        elif kind == 'github':
+            snapshots[kind] = dict(data)
+            if previous is None:
+                return
+            changed = {k: v for k, v in data.items() if previous.get(k) != v}
+            if changed:
+                self.publish(user, {'type': 'github', 'profile': changed})
+
+
+feed = ChangeFeed()
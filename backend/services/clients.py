@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import os
+import time
+from contextvars import ContextVar
+import httpx
+from services import metrics, policy
+from services.cache import response_cache
+from services.singleflight import flights
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Per-provider pool settings. http2 is only used where the upstream speaks it;
+# ip-api.com (geolocation fallback, services/geo.py) is plain HTTP/1.1.
+PROVIDERS = {
+    'google': {'http2': True, 'max_connections': 50, 'max_keepalive': 20},
+    'microsoft': {'http2': True, 'max_connections': 50, 'max_keepalive': 20},
+    'github': {'http2': True, 'max_connections': 20, 'max_keepalive': 10},
+    'auth0': {'http2': True, 'max_connections': 10, 'max_keepalive': 5},
+    'ipapi': {'http2': False, 'max_connections': 10, 'max_keepalive': 5},
+}
+
+# Opened at startup so the first user requests don't pay for TCP/TLS setup
+WARMUP_URLS = {
+    'google': ('https://www.googleapis.com/', 'https://gmail.googleapis.com/'),
+    'microsoft': ('https://graph.microsoft.com/',),
+    'github': ('https://api.github.com/',),
+}
+POOL_WARMUP = os.environ.get('POOL_WARMUP', '1') != '0'
+WARMUP_TIMEOUT = 5.0
+
+# Set by the background refresher: skip fresh cache hits and go upstream
+# (still conditionally, with If-None-Match)
+refreshing = ContextVar('refreshing', default=False)
+
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 10.0
+
+
+def _env_number(name, default, cast=int):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"Invalid value for {name}: {value!r}, using {default}")
+        return default
+
+
+def provider_settings(provider: str):
+    # Env overrides, e.g. HTTP_GOOGLE_MAX_CONNECTIONS=100
+    base = PROVIDERS.get(provider, {'http2': False, 'max_connections': 10, 'max_keepalive': 5})
+    prefix = f"HTTP_{provider.upper()}_"
+    return {
+        'http2': base['http2'] and HTTP2_AVAILABLE,
+        'max_connections': _env_number(prefix + 'MAX_CONNECTIONS', base['max_connections']),
+        'max_keepalive': _env_number(prefix + 'MAX_KEEPALIVE', base['max_keepalive']),
+        'keepalive_expiry': _env_number('HTTP_KEEPALIVE_EXPIRY', DEFAULT_KEEPALIVE_EXPIRY, float),
+        'timeout': _env_number('HTTP_TIMEOUT', DEFAULT_TIMEOUT, float),
+    }
+
+
+class ClientRegistry:
+    """App-scoped httpx clients, one connection pool per provider."""
+
+    def __init__(self, transport=None):
+        self._clients = {}
+        self._transport = transport
+        self._requests = {}
+        self._warmup_task = None
+        self.started = False
+        self.warmup = {}
+
+    def _build(self, provider: str):
+        settings = provider_settings(provider)
+        limits = httpx.Limits(
+            max_connections=settings['max_connections'],
+            max_keepalive_connections=settings['max_keepalive'],
+            keepalive_expiry=settings['keepalive_expiry'],
+        )
+
+        async def count_request(request):
+            self._requests[provider] = self._requests.get(provider, 0) + 1
+
+        kwargs = {
+            'limits': limits,
+            'timeout': settings['timeout'],
+            'event_hooks': {'request': [count_request]},
+        }
+        if self._transport is not None:
+            kwargs['transport'] = self._transport
+        else:
+            kwargs['http2'] = settings['http2']
+        return httpx.AsyncClient(**kwargs)
+
+    def get(self, provider: str) -> httpx.AsyncClient:
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            client = self._build(provider)
+            self._clients[provider] = client
+        return client
+
+    def use_transport(self, transport):
+        # Used by benchmarks/tests to route every provider through a stub transport
+        self._transport = transport
+
+    async def start(self):
+        for provider in PROVIDERS:
+            self.get(provider)
+        self.started = True
+        # Stub transports (benchmarks) have nothing to warm up
+        if POOL_WARMUP and self._transport is None and self._warmup_task is None:
+            self.warmup = {provider: 'pending' for provider in WARMUP_URLS}
+            self._warmup_task = asyncio.ensure_future(self._warm())
+
+    async def _warm(self):
+        async def warm(provider, urls):
+            client = self.get(provider)
+            try:
+                # Any answer will do (usually 404); it leaves an open connection in the pool
+                await asyncio.gather(*(client.head(url, timeout=WARMUP_TIMEOUT) for url in urls))
+                self.warmup[provider] = 'warm'
+            except httpx.HTTPError as e:
+                self.warmup[provider] = f"failed: {type(e).__name__}"
+
+        await asyncio.gather(*(warm(provider, urls) for provider, urls in WARMUP_URLS.items()))
+
+    async def close(self):
+        self.started = False
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+            self._warmup_task = None
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def stats(self):
+        result = {}
+        for provider, client in self._clients.items():
+            settings = provider_settings(provider)
+            entry = {
+                'http2': settings['http2'] and self._transport is None,
+                'max_connections': settings['max_connections'],
+                'max_keepalive': settings['max_keepalive'],
+                'requests': self._requests.get(provider, 0),
+            }
+            pool = getattr(getattr(client, '_transport', None), '_pool', None)
+            connections = getattr(pool, 'connections', None)
+            if connections is not None:
+                idle = sum(1 for conn in connections if conn.is_idle())
+                entry['connections'] = len(connections)
+                entry['idle'] = idle
+                entry['active'] = len(connections) - idle
+                pending = getattr(pool, '_requests', [])
+                entry['queued'] = sum(1 for req in pending if getattr(req, 'is_queued', lambda: False)())
+            result[provider] = entry
+        return result
+
+
+registry = ClientRegistry()
+
+
+def token_key(token: str) -> str:
+    # Stable per-user key derived from a bearer token, so raw tokens never become cache keys
+    return hashlib.sha256(token.encode()).hexdigest()[:32] if token else ''
+
+
+def get_client(provider: str) -> httpx.AsyncClient:
+    return registry.get(provider)
+
+
+async def fetch(provider: str, url: str, token: str = None, method: str = 'GET', wait: bool = True,
+                **kwargs) -> httpx.Response:
+    # wait=False: fail with policy.Throttled rather than queue for the rate limit
+    headers = dict(kwargs.pop('headers', None) or {})
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    client = get_client(provider)
+    started = time.perf_counter()
+    try:
+        # Rate limits, retries/backoff and the circuit breaker (services/policy.py)
+        resp = await policy.send(provider, method, lambda: client.request(method, url, headers=headers, **kwargs),
+                                 user=token_key(token) if token else None, wait=wait)
+    except policy.Throttled:
+        metrics.observe_upstream(provider, started, error='throttled')
+        raise
+    except policy.ProviderUnavailable:
+        metrics.observe_upstream(provider, started, error='circuit_open')
+        raise
+    except Exception as e:
+        metrics.observe_upstream(provider, started, error=type(e).__name__)
+        raise
+    metrics.observe_upstream(provider, started, resp)
+    return resp
+
+
+def cache_key(provider: str, url: str, token: str = None, params=None):
+    endpoint = str(httpx.URL(url, params=params)) if params else url
+    return (token_key(token), provider, endpoint)
+
+
+async def get_json(provider: str, url: str, token: str = None, params=None, ttl: float = None, cache: bool = True, **kwargs):
+    # Cached, conditionally revalidated GET. Returned objects are shared between
+    # callers and must not be mutated. Identical concurrent misses share one
+    # upstream request.
+    key = cache_key(provider, url, token, params)
+    if not cache:
+        return await flights.do(('get', *key), lambda: _get(provider, url, token, params, kwargs))
+
+    entry = response_cache.get(key)
+    if entry is not None and entry.fresh() and not refreshing.get():
+        response_cache.hits += 1
+        metrics.cache_lookups.inc(provider, 'hit')
+        return entry.value
+    return await flights.do(('cached', *key), lambda: _revalidate(key, provider, url, token, params, ttl, kwargs))
+
+
+async def _get(provider, url, token, params, kwargs):
+    try:
+        resp = await fetch(provider, url, token, params=params, **kwargs)
+    except policy.ProviderUnavailable as e:
+        return e.payload
+    return _payload(resp)
+
+
+def _payload(resp):
+    data = resp.json()
+    if not resp.is_success and isinstance(data, dict) and 'error' not in data:
+        # GitHub error bodies only carry a message; every failure gets an 'error' key
+        data = {**data, 'error': data.get('message') or f"HTTP {resp.status_code}"}
+    return data
+
+
+async def _revalidate(key, provider, url, token, params, ttl, kwargs):
+    entry = response_cache.get(key)
+    headers = dict(kwargs.pop('headers', None) or {})
+    if entry is not None and entry.etag:
+        headers['If-None-Match'] = entry.etag
+    try:
+        resp = await fetch(provider, url, token, params=params, headers=headers, **kwargs)
+    except policy.ProviderUnavailable as e:
+        # Circuit open: serve whatever we have, however old, else an error dict
+        return entry.value if entry is not None else e.payload
+    if resp.status_code == 304 and entry is not None:
+        response_cache.hits += 1
+        metrics.cache_lookups.inc(provider, 'revalidated')
+        if response_cache.touch(key, ttl) is None:
+            # Evicted while the conditional GET was in flight; the body we hold is still current
+            response_cache.put(key, entry.value, etag=entry.etag, size=entry.size, ttl=ttl)
+        return entry.value
+
+    response_cache.misses += 1
+    metrics.cache_lookups.inc(provider, 'miss')
+    data = _payload(resp)
+    if resp.is_success:
+        response_cache.put(key, data, etag=resp.headers.get('etag'), size=len(resp.content), ttl=ttl)
+    return data
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+DEFAULT_DEADLINE = 4.0
+DEFAULT_TIMEOUT = 3.0
+STALE_MAX_ENTRIES = 2048
+
+# Last good result per (scope, name), served as 'stale' when a fetch misses its budget
+_last_good = OrderedDict()
+
+
+class Call:
+    def __init__(self, fn, *args, timeout: float = None, fallback=None, stale: bool = True, expects: type = None):
+        self.fn = fn
+        self.args = args
+        self.timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+        self.fallback = fallback
+        self.stale = stale
+        # Type a stale value must have to be served; defaults to the fallback's
+        self.expects = expects if expects is not None else (type(fallback) if fallback is not None else None)
+
+
+def _remember(key, value):
+    _last_good[key] = (time.time(), value)
+    _last_good.move_to_end(key)
+    while len(_last_good) > STALE_MAX_ENTRIES:
+        _last_good.popitem(last=False)
+
+
+def forget(scope):
+    for key in [k for k in _last_good if k[0] == scope]:
+        del _last_good[key]
+
+
+def _failed(value) -> bool:
+    # Service getters report upstream failures as a payload with an 'error' key
+    return isinstance(value, dict) and 'error' in value
+
+
+def _degraded(key, call: Call, status: str, error: str):
+    stored = _last_good.get(key) if call.stale else None
+    if stored is not None and (call.expects is None or isinstance(stored[1], call.expects)):
+        fetched_at, value = stored
+        if isinstance(value, dict):
+            return {**value, 'status': 'stale', 'error': error, 'fetched_at': fetched_at}
+        return value
+    fallback = call.fallback
+    if isinstance(fallback, dict):
+        return {**fallback, 'status': status, 'error': error}
+    return fallback
+
+
+async def _run(call: Call):
+    return await asyncio.wait_for(call.fn(*call.args), timeout=call.timeout)
+
+
+async def fan_out(calls: dict, scope: str = None, deadline: float = None):
+    # Run every call concurrently; anything not done by the deadline is cancelled
+    # and replaced by its last good value (status 'stale') or its fallback
+    # (status 'timeout' / 'error').
+    deadline = DEFAULT_DEADLINE if deadline is None else deadline
+    tasks = {name: asyncio.ensure_future(_run(call)) for name, call in calls.items()}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=deadline)
+
+    results = {}
+    for name, task in tasks.items():
+        call = calls[name]
+        key = (scope, name)
+        if not task.done():
+            task.cancel()
+            results[name] = _degraded(key, call, 'timeout', f'{name} exceeded the {deadline}s deadline')
+            continue
+        exc = task.exception()
+        if isinstance(exc, asyncio.TimeoutError):
+            results[name] = _degraded(key, call, 'timeout', f'{name} timed out after {call.timeout}s')
+        elif exc is not None:
+            results[name] = _degraded(key, call, 'error', str(exc))
+        else:
+            value = task.result()
+            if scope is not None and call.stale and not _failed(value):
+                _remember(key, value)
+            results[name] = value
+    return results
@@ -0,0 +1,189 @@
+import csv
+import gzip
+import ipaddress
+import os
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+from services.clients import fetch
+from services.policy import Throttled
+
+# Offline IP geolocation. GEOIP_DB points at a CSV (optionally .gz) of ranges:
+#
+#   ip_start,ip_end,country_code,country,region,city,timezone
+#
+# build_geoip.py produces it from DB-IP's free "IP to City Lite" download.
+# Addresses may be dotted/colon notation or integers, IPv4 and IPv6 mixed.
+# Ranges are kept in sorted arrays and answered with a binary search;
+# identical locations are stored once and referenced by index.
+#
+# Until a table is installed, locate() asks ip-api.com instead (as the app
+# always did), rate limited and cached per address. GEOIP_REMOTE_URL=''
+# turns that off.
+
+GEOIP_DB = os.environ.get('GEOIP_DB', os.path.join(os.path.dirname(__file__), '..', 'data', 'geoip.csv.gz'))
+CACHE_SIZE = int(os.environ.get('GEOIP_CACHE_SIZE', '65536'))
+REMOTE_URL = os.environ.get('GEOIP_REMOTE_URL', 'http://ip-api.com/json/{ip}')
+REMOTE_TIMEOUT = 2.0
+
+
+class _Table:
+    def __init__(self, typecode):
+        # IPv6 values exceed 64 bits, so that table falls back to plain lists
+        self.starts = array(typecode) if typecode else []
+        self.ends = array(typecode) if typecode else []
+        self.locations = array('I')
+
+    def find(self, value: int):
+        i = bisect_right(self.starts, value) - 1
+        if i >= 0 and value <= self.ends[i]:
+            return self.locations[i]
+        return None
+
+
+class GeoDatabase:
+    def __init__(self):
+        self.v4 = _Table('Q')
+        self.v6 = _Table(None)
+        self.locations = []
+
+    @classmethod
+    def from_csv(cls, path: str):
+        opener = gzip.open if path.endswith('.gz') else open
+        location_ids = {}
+        db = cls()
+        ordered = True
+        with opener(path, 'rt', newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 7 or row[0].startswith('#') or row[0] == 'ip_start':
+                    continue
+                try:
+                    start, end = _to_ip(row[0]), _to_ip(row[1])
+                except ValueError:
+                    continue
+                location = tuple(row[2:7])
+                index = location_ids.get(location)
+                if index is None:
+                    index = location_ids[location] = len(db.locations)
+                    db.locations.append(location)
+                # Appended straight into the tables: a full city-level table
+                # has millions of rows, too many to stage as tuples
+                table = db.v4 if start.version == 4 else db.v6
+                if ordered and table.starts and int(start) < table.starts[-1]:
+                    ordered = False
+                table.starts.append(int(start))
+                table.ends.append(int(end))
+                table.locations.append(index)
+        if not ordered:
+            db._sort()
+        return db
+
+    def _sort(self):
+        for table in (self.v4, self.v6):
+            rows = sorted(zip(table.starts, table.ends, table.locations))
+            typecode = table.starts.typecode if isinstance(table.starts, array) else None
+            table.starts = array(typecode, (r[0] for r in rows)) if typecode else [r[0] for r in rows]
+            table.ends = array(typecode, (r[1] for r in rows)) if typecode else [r[1] for r in rows]
+            table.locations = array('I', (r[2] for r in rows))
+
+    def lookup(self, ip: str):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        table = self.v4 if address.version == 4 else self.v6
+        index = table.find(int(address))
+        if index is None:
+            return None
+        country_code, country, region, city, timezone = self.locations[index]
+        return {
+            'city': city or None,
+            'region': region or None,
+            'country': country or None,
+            'countryCode': country_code or None,
+            'timezone': timezone or None,
+        }
+
+    def __len__(self):
+        return len(self.v4.starts) + len(self.v6.starts)
+
+
+def _to_ip(value: str):
+    value = value.strip()
+    return ipaddress.ip_address(int(value) if value.isdigit() else value)
+
+
+_database = None
+
+
+def load(path: str = None):
+    global _database
+    path = path or GEOIP_DB
+    try:
+        _database = GeoDatabase.from_csv(path)
+        print(f"Loaded {len(_database)} IP ranges from {path}")
+    except FileNotFoundError:
+        fallback = 'using ip-api.com' if REMOTE_URL else 'location lookup disabled'
+        print(f"GeoIP database not found at {path} (see build_geoip.py), {fallback}")
+        _database = GeoDatabase()
+    except Exception as e:
+        print(f"GeoIP database error: {e}")
+        _database = GeoDatabase()
+    lookup.cache_clear()
+    return _database
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lookup(ip: str):
+    """Location fields for an IP address, or None when it is not in the table."""
+    if _database is None:
+        load()
+    return _database.lookup(ip)
+
+
+_remote = OrderedDict()
+
+
+async def locate(ip: str):
+    """lookup(), falling back to ip-api.com while no local table is installed."""
+    if _database is None:
+        load()
+    if len(_database) or not REMOTE_URL:
+        return lookup(ip)
+    try:
+        if not ipaddress.ip_address(ip).is_global:
+            return None
+    except ValueError:
+        return None
+    if ip in _remote:
+        _remote.move_to_end(ip)
+        return _remote[ip]
+    try:
+        # Over the free tier's rate the location is left out rather than
+        # making the request wait for the limiter
+        resp = await fetch('ipapi', REMOTE_URL.format(ip=ip), wait=False, timeout=REMOTE_TIMEOUT)
+        data = resp.json() if resp.status_code == 200 else None
+    except Throttled:
+        return None
+    except Exception as e:
+        # Not cached: the next request tries again
+        print(f"Error fetching location: {e}")
+        return None
+    details = None
+    if isinstance(data, dict) and data.get('status') == 'success':
+        details = {
+            'city': data.get('city') or None,
+            'region': data.get('regionName') or None,
+            'country': data.get('country') or None,
+            'countryCode': data.get('countryCode') or None,
+            'timezone': data.get('timezone') or None,
+        }
+    elif data is None:
+        return None
+    _remote[ip] = details
+    while len(_remote) > CACHE_SIZE:
+        _remote.popitem(last=False)
+    return details
@@ -1,19 +1,16 @@
-import httpx
+from services import search
+from services.clients import get_json, token_key
 
 async def get_profile(token: str):
     if not token:
         return {"profile": {"name": "GitHub User", "email": "user@github.com"}}
-    headers = {"Authorization": f"Bearer {token}"}
     url = "https://api.github.com/user"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers)
-        return resp.json()
+    profile = await get_json('github', url, token)
+    search.index.observe(token_key(token), 'github', profile)
+    return profile
 
 async def get_email(token: str):
     if not token:
         return {"emails": ["user@github.com"]}
-    headers = {"Authorization": f"Bearer {token}"}
     url = "https://api.github.com/user/emails"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers)
-        return resp.json() 
\ No newline at end of file
+    return await get_json('github', url, token)
@@ -1,31 +1,149 @@
-import httpx
+from services import paging, search, sync
+from services.clients import token_key
+from services.meetings import MEET_HOST, join_link
+from services.messages import forget_gmail, hydrate_gmail, set_gmail_labels
+
+GMAIL_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+CALENDAR_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
+PAGE_SIZE = 250
+MESSAGE_LIMIT = 100
+# Messages carrying any of these are not part of the listing
+HIDDEN_LABELS = {'SPAM', 'TRASH', 'DRAFT'}
 
 async def get_gmail_messages(token: str):
     if not token:
         return {"messages": []}
-    headers = {"Authorization": f"Bearer {token}"}
-    url = "https://gmail.googleapis.com/gmail/v1/users/me/messages"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers)
-        return resp.json()
+    try:
+        state = await sync.synced('gmail', token, _gmail_full_sync, _gmail_history_sync)
+    except sync.UpstreamError as e:
+        return {"messages": [], **e.payload}
+    # Newest first, like the first page of users/me/messages
+    messages = await hydrate_gmail(token, list(state.items.values())[:MESSAGE_LIMIT])
+    result = {"messages": messages, "resultSizeEstimate": len(state.items), "historyId": state.cursor}
+    search.index.observe(token_key(token), 'gmail', result)
+    return result
+
+async def _gmail_full_sync(token: str, state):
+    # Read the current historyId first so nothing that lands during the listing is missed
+    profile = await sync.fetch_page('google', f"{GMAIL_URL}/profile", token)
+    data = await sync.fetch_page('google', f"{GMAIL_URL}/messages", token, {'maxResults': MESSAGE_LIMIT})
+    # Label changes since the cached summaries were taken are unknown
+    forget_gmail(token)
+    for message in data.get('messages', []):
+        state.upsert(message['id'], {'id': message['id'], 'threadId': message.get('threadId')})
+    state.cursor = profile.get('historyId')
+
+def _gmail_entry(message):
+    entry = {'id': message['id'], 'threadId': message.get('threadId')}
+    if 'labelIds' in message:
+        entry['labelIds'] = message['labelIds']
+    return entry
+
+def _gmail_labels_changed(token: str, state, message, removed=()):
+    # `message.labelIds` is the full label set after the change
+    message_id = message['id']
+    labels = message.get('labelIds', [])
+    if HIDDEN_LABELS & set(labels):
+        # Trashed or marked as spam: gone from the listing
+        state.remove(message_id)
+        forget_gmail(token, message_id)
+    elif message_id in state.items:
+        state.upsert(message_id, _gmail_entry(message))
+        set_gmail_labels(token, message_id, labels)
+    elif HIDDEN_LABELS & set(removed):
+        # Restored from Trash/Spam
+        state.upsert(message_id, _gmail_entry(message), newest_first=True)
+
+async def _gmail_history_sync(token: str, state):
+    params = {
+        'startHistoryId': state.cursor,
+        'historyTypes': ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+    }
+    while True:
+        # Gmail answers 404 once a startHistoryId is too old
+        data = await sync.fetch_page('google', f"{GMAIL_URL}/history", token, params, gone=(404, 410))
+        for record in data.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added['message']
+                if HIDDEN_LABELS & set(message.get('labelIds', [])):
+                    continue
+                state.upsert(message['id'], _gmail_entry(message), newest_first=True)
+            for change in record.get('labelsAdded', []):
+                _gmail_labels_changed(token, state, change['message'])
+            for change in record.get('labelsRemoved', []):
+                _gmail_labels_changed(token, state, change['message'], change.get('labelIds', []))
+            for deleted in record.get('messagesDeleted', []):
+                state.remove(deleted['message']['id'])
+                forget_gmail(token, deleted['message']['id'])
+        if data.get('nextPageToken'):
+            params = {**params, 'pageToken': data['nextPageToken']}
+            continue
+        state.cursor = data.get('historyId', state.cursor)
+        return
+
+async def iter_gmail_messages(token: str):
+    # Every message ID in the mailbox, page by page
+    if not token:
+        return
+    async for message in paging.iter_pages('google', token, f"{GMAIL_URL}/messages", {'maxResults': 500},
+                                           paging.google_next_page, items_key='messages'):
+        yield message
 
 async def get_calendar_events(token: str):
     if not token:
         return {"items": []}
-    headers = {"Authorization": f"Bearer {token}"}
-    url = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers)
-        return resp.json()
+    try:
+        state = await calendar_state(token)
+    except sync.UpstreamError as e:
+        return {"items": [], **e.payload}
+    result = {"items": list(state.items.values())}
+    search.index.observe(token_key(token), 'google_calendar', result, version=(id(state), state.version))
+    return result
+
+async def calendar_state(token: str):
+    # The synced copy itself, for indexes built on top of it (timeline)
+    return await sync.synced('google_calendar', token, _calendar_sync, _calendar_sync, recency=sync.nearest_to_now)
+
+async def _calendar_sync(token: str, state):
+    # Same walk for the initial listing and for syncToken changes; the
+    # final page carries the nextSyncToken for the following refresh.
+    # singleEvents expands recurring series into their instances (as Graph's
+    # calendarView does) and must be sent on every round. The initial listing
+    # covers the same window as the Microsoft calendar; timeMin/timeMax may
+    # not go along with a syncToken, so the window is refreshed by a periodic
+    # full sync instead.
+    base = {'maxResults': PAGE_SIZE, 'singleEvents': 'true'}
+    if state.cursor:
+        base['syncToken'] = state.cursor
+    else:
+        base['timeMin'], base['timeMax'] = sync.calendar_window(state)
+    params = base
+    while True:
+        data = await sync.fetch_page('google', CALENDAR_URL, token, params)
+        for event in data.get('items', []):
+            if event.get('status') == 'cancelled':
+                state.remove(event['id'])
+            else:
+                state.upsert(event['id'], event)
+        if data.get('nextPageToken'):
+            params = {**base, 'pageToken': data['nextPageToken']}
+            continue
+        state.cursor = data.get('nextSyncToken')
+        return
+
+async def iter_calendar_events(token: str):
+    if not token:
+        return
+    async for event in paging.iter_pages('google', token, CALENDAR_URL, {'maxResults': PAGE_SIZE},
+                                         paging.google_next_page, items_key='items'):
+        yield event
 
 async def get_meet_links(token: str):
-    # Fetch Google Calendar events and extract Meet links
+    # Meet links from the synced calendar copy; no extra calendar download
     events = await get_calendar_events(token)
     meet_links = []
     for event in events.get('items', []):
-        conference = event.get('conferenceData', {})
-        if 'entryPoints' in conference:
-            for entry in conference['entryPoints']:
-                if entry.get('entryPointType') == 'video' and 'meet.google.com' in entry.get('uri', ''):
-                    meet_links.append(entry['uri'])
-    return {"meet_links": meet_links}
\ No newline at end of file
+        link = join_link('google', event)
+        if link and MEET_HOST in link:
+            meet_links.append(link)
+    return {"meet_links": meet_links}
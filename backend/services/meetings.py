@@ -0,0 +1,69 @@
+import re
+from collections import OrderedDict
+
+# Join-link extraction for calendar events. Structured fields are checked
+# first; free text (descriptions, HTML bodies) is only run through the
+# precompiled patterns when a cheap substring test says a link can be there.
+# Results are cached per event id + etag/changeKey, so an unchanged event is
+# never scanned twice.
+
+CACHE_SIZE = 50000
+
+MEET_HOST = 'meet.google.com'
+TEAMS_HOST = 'teams.microsoft.com'
+MEET_RE = re.compile(r'https://meet\.google\.com/[a-z]{3}-[a-z]{4}-[a-z]{3}')
+TEAMS_RE = re.compile(r'https://teams\.microsoft\.com/l/meetup-join/[^\s"\'<>]+')
+
+_links = OrderedDict()
+_MISSING = object()
+
+
+def _scan(text: str):
+    if not text:
+        return None
+    if MEET_HOST in text:
+        match = MEET_RE.search(text)
+        if match:
+            return match.group(0)
+    if TEAMS_HOST in text:
+        match = TEAMS_RE.search(text)
+        if match:
+            return match.group(0)
+    return None
+
+
+def _google_link(event: dict):
+    for entry in (event.get('conferenceData') or {}).get('entryPoints', []):
+        if entry.get('entryPointType') == 'video' and entry.get('uri'):
+            return entry['uri']
+    if event.get('hangoutLink'):
+        return event['hangoutLink']
+    return _scan(event.get('location')) or _scan(event.get('description'))
+
+
+def _microsoft_link(event: dict):
+    join_url = (event.get('onlineMeeting') or {}).get('joinUrl') or event.get('onlineMeetingUrl')
+    if join_url:
+        return join_url
+    location = (event.get('location') or {}).get('displayName')
+    return _scan(location) or _scan((event.get('body') or {}).get('content'))
+
+
+_EXTRACTORS = {'google': _google_link, 'microsoft': _microsoft_link}
+
+
+def join_link(provider: str, event: dict):
+    """The meeting join URL of an event, or None."""
+    version = event.get('etag') or event.get('changeKey')
+    key = (provider, event.get('id'), version)
+    if event.get('id') and version:
+        cached = _links.get(key, _MISSING)
+        if cached is not _MISSING:
+            _links.move_to_end(key)
+            return cached
+    link = _EXTRACTORS[provider](event)
+    if event.get('id') and version:
+        _links[key] = link
+        while len(_links) > CACHE_SIZE:
+            _links.popitem(last=False)
+    return link
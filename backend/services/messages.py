@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict
+import httpx
+from services import clients
+from services.policy import UpstreamError
+from services.clients import token_key
+
+# Message metadata hydration. Lists from Gmail only carry IDs, so the header
+# fields the dashboard shows are fetched in bulk: Gmail's batch endpoint
+# (GMAIL_BATCH_SIZE messages per request) and Graph $batch (20 per request).
+# Metadata is cached per message ID, so only new messages cost a request.
+# Labels are the mutable part of a Gmail summary: the history sync reports
+# label changes and updates the cached copy through set_gmail_labels().
+
+GMAIL_BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+GRAPH_BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+GMAIL_BATCH_SIZE = int(os.environ.get('GMAIL_BATCH_SIZE', '50'))
+GRAPH_BATCH_SIZE = 20  # Graph's hard limit per $batch
+CONCURRENCY = int(os.environ.get('HYDRATE_CONCURRENCY', '4'))
+CACHE_SIZE = int(os.environ.get('MESSAGE_CACHE_SIZE', '20000'))
+
+GMAIL_HEADERS = ('Subject', 'From', 'Date')
+OUTLOOK_FIELDS = 'id,subject,from,receivedDateTime,isRead,bodyPreview,webLink'
+
+_semaphore = None
+_metadata = OrderedDict()
+
+
+def _limit():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(CONCURRENCY)
+    return _semaphore
+
+
+def _cached(key):
+    value = _metadata.get(key)
+    if value is not None:
+        _metadata.move_to_end(key)
+    return value
+
+
+def _remember(key, value):
+    _metadata[key] = value
+    _metadata.move_to_end(key)
+    while len(_metadata) > CACHE_SIZE:
+        _metadata.popitem(last=False)
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# === GMAIL ===
+
+def _gmail_summary(message: dict) -> dict:
+    headers = {h.get('name', '').lower(): h.get('value') for h in (message.get('payload') or {}).get('headers', [])}
+    return {
+        'id': message.get('id'),
+        'threadId': message.get('threadId'),
+        'labelIds': message.get('labelIds', []),
+        'snippet': message.get('snippet', ''),
+        'subject': headers.get('subject', ''),
+        'from': headers.get('from', ''),
+        'date': headers.get('date', ''),
+        'internalDate': message.get('internalDate'),
+    }
+
+
+def _gmail_batch_body(ids, boundary):
+    query = '&'.join(f"metadataHeaders={name}" for name in GMAIL_HEADERS)
+    parts = []
+    for i, message_id in enumerate(ids):
+        parts.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item-{i}>\r\n\r\n"
+            f"GET /gmail/v1/users/me/messages/{message_id}?format=metadata&{query}\r\n\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return ''.join(parts)
+
+
+def _parse_multipart(resp):
+    # Each part wraps a full HTTP response; keep the JSON body of the 2xx ones
+    content_type = resp.headers.get('content-type', '')
+    boundary = content_type.split('boundary=')[-1].strip('"') if 'boundary=' in content_type else None
+    if not boundary:
+        return []
+    bodies = []
+    for part in resp.text.split(f"--{boundary}"):
+        status_at = part.find('HTTP/1.1 ')
+        if status_at < 0:
+            continue
+        status = part[status_at + 9:status_at + 12]
+        body_at = part.find('\r\n\r\n', status_at)
+        if not status.startswith('2') or body_at < 0:
+            continue
+        try:
+            bodies.append(json.loads(part[body_at + 4:].strip()))
+        except ValueError:
+            continue
+    return bodies
+
+
+async def _gmail_batch(token: str, ids):
+    boundary = f"batch_{uuid.uuid4().hex}"
+    try:
+        async with _limit():
+            resp = await clients.fetch(
+                'google', GMAIL_BATCH_URL, token, method='POST',
+                content=_gmail_batch_body(ids, boundary),
+                headers={'Content-Type': f'multipart/mixed; boundary={boundary}'},
+            )
+    except (UpstreamError, httpx.HTTPError) as e:
+        # Circuit open, throttled or unreachable: callers serve what they have
+        print(f"Gmail batch failed: {e}")
+        return []
+    if not resp.is_success:
+        print(f"Gmail batch failed with {resp.status_code}")
+        return []
+    return _parse_multipart(resp)
+
+
+async def hydrate_gmail(token: str, messages):
+    """Add subject/from/date/snippet to Gmail {id, threadId} entries."""
+    user = token_key(token)
+    missing = [m['id'] for m in messages if _cached((user, 'gmail', m['id'])) is None]
+    if missing:
+        batches = await asyncio.gather(*(_gmail_batch(token, chunk) for chunk in _chunks(missing, GMAIL_BATCH_SIZE)))
+        for batch in batches:
+            for message in batch:
+                if message.get('id'):
+                    _remember((user, 'gmail', message['id']), _gmail_summary(message))
+    return [_cached((user, 'gmail', m['id'])) or m for m in messages]
+
+
+def set_gmail_labels(token: str, message_id: str, label_ids):
+    key = (token_key(token), 'gmail', message_id)
+    summary = _metadata.get(key)
+    if summary is not None:
+        # Cached summaries are shared with callers; replace, don't mutate
+        _metadata[key] = {**summary, 'labelIds': list(label_ids)}
+
+
+def forget_user(token: str):
+    user = token_key(token)
+    for key in [k for k in _metadata if k[0] == user]:
+        del _metadata[key]
+
+
+def forget_gmail(token: str, message_id: str = None):
+    """Drop one cached Gmail summary, or all of this user's when no ID is given."""
+    user = token_key(token)
+    if message_id is not None:
+        _metadata.pop((user, 'gmail', message_id), None)
+        return
+    for key in [k for k in _metadata if k[0] == user and k[1] == 'gmail']:
+        del _metadata[key]
+
+
+# === OUTLOOK ===
+
+async def _graph_batch(token: str, ids):
+    body = {'requests': [
+        {'id': str(i), 'method': 'GET', 'url': f"/me/messages/{message_id}?$select={OUTLOOK_FIELDS}"}
+        for i, message_id in enumerate(ids)
+    ]}
+    try:
+        async with _limit():
+            resp = await clients.fetch('microsoft', GRAPH_BATCH_URL, token, method='POST', json=body)
+    except (UpstreamError, httpx.HTTPError) as e:
+        print(f"Graph $batch failed: {e}")
+        return []
+    if not resp.is_success:
+        print(f"Graph $batch failed with {resp.status_code}")
+        return []
+    return [r.get('body') for r in resp.json().get('responses', []) if 200 <= r.get('status', 0) < 300]
+
+
+async def hydrate_outlook(token: str, messages):
+    """Fill in Outlook messages that arrived without the selected fields."""
+    user = token_key(token)
+    for message in messages:
+        if 'subject' in message:
+            _remember((user, 'outlook', message['id']), message)
+    missing = [m['id'] for m in messages if _cached((user, 'outlook', m['id'])) is None]
+    if missing:
+        batches = await asyncio.gather(*(_graph_batch(token, chunk) for chunk in _chunks(missing, GRAPH_BATCH_SIZE)))
+        for batch in batches:
+            for message in batch:
+                if message and message.get('id'):
+                    _remember((user, 'outlook', message['id']), message)
+    return [_cached((user, 'outlook', m['id'])) or m for m in messages]
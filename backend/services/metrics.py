@@ -0,0 +1,261 @@
+import os
+import random
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+
+# Process-local metrics in the Prometheus text format (served at /metrics):
+# request latency by route, upstream latency/errors/payload sizes by provider,
+# Firestore operation latency and response-cache results. Counters and
+# histograms are plain dicts updated on the event loop; gauges are collected
+# from the existing stats() methods when /metrics is scraped.
+#
+# Slow-request tracing: with SLOW_REQUEST_MS set, a sampled share of requests
+# records the time spent waiting on upstreams and Firestore. Requests over the
+# threshold are logged with that breakdown; whatever is not I/O is handler
+# code and JSON encoding.
+
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))  # 0 disables tracing
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+SLOW_LOG_SIZE = 100
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BATCH_BUCKETS = (1, 2, 5, 10, 50, 100, 500)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, value=1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def lines(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            # per-bucket counts (+Inf last), sum
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def lines(self):
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_number(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class Gauge:
+    """Read from `collect()` (returning {label values: value}) at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def lines(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Metrics collector {self.name} failed: {e}")
+            return
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_number(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        out = []
+        for metric in self._metrics:
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(metric.lines())
+        return '\n'.join(out) + '\n'
+
+
+registry = Registry()
+
+http_duration = registry.register(Histogram(
+    'hub_http_request_duration_seconds', 'Time to serve a request', ('route', 'method', 'status')))
+http_response_bytes = registry.register(Histogram(
+    'hub_http_response_bytes', 'Response body size', ('route',), SIZE_BUCKETS))
+http_errors = registry.register(Counter(
+    'hub_http_errors_total', 'Requests that failed with a 5xx or an unhandled exception', ('route',)))
+
+upstream_duration = registry.register(Histogram(
+    'hub_upstream_request_duration_seconds', 'Upstream call time, retries included', ('provider', 'status')))
+upstream_response_bytes = registry.register(Histogram(
+    'hub_upstream_response_bytes', 'Upstream response body size', ('provider',), SIZE_BUCKETS))
+upstream_errors = registry.register(Counter(
+    'hub_upstream_errors_total', 'Upstream calls that failed or answered 429/5xx', ('provider', 'reason')))
+
+db_duration = registry.register(Histogram(
+    'hub_db_operation_duration_seconds', 'Firestore batch read/commit time', ('operation',)))
+db_batch_size = registry.register(Histogram(
+    'hub_db_batch_size', 'Documents per Firestore batch', ('operation',), BATCH_BUCKETS))
+db_errors = registry.register(Counter(
+    'hub_db_errors_total', 'Failed Firestore batches', ('operation',)))
+
+cache_lookups = registry.register(Counter(
+    'hub_cache_lookups_total', 'Response cache lookups by result (hit, revalidated, miss)', ('provider', 'result')))
+
+
+def _status_class(status) -> str:
+    return f"{str(status)[0]}xx" if isinstance(status, int) else str(status)
+
+
+def observe_upstream(provider: str, started: float, resp=None, error: str = None):
+    elapsed = time.perf_counter() - started
+    if resp is not None:
+        upstream_duration.observe(elapsed, provider, _status_class(resp.status_code))
+        upstream_response_bytes.observe(len(resp.content), provider)
+        if resp.status_code == 429 or resp.status_code >= 500:
+            upstream_errors.inc(provider, f"http_{resp.status_code}")
+    else:
+        upstream_duration.observe(elapsed, provider, 'error')
+        upstream_errors.inc(provider, error)
+    span('upstream', provider, started)
+
+
+def observe_db(operation: str, started: float, size: int, failed: bool = False):
+    db_duration.observe(time.perf_counter() - started, operation)
+    db_batch_size.observe(size, operation)
+    if failed:
+        db_errors.inc(operation)
+
+
+def observe_request(route: str, method: str, status, started: float, size: int, failed: bool):
+    elapsed = time.perf_counter() - started
+    http_duration.observe(elapsed, route, method, str(status))
+    http_response_bytes.observe(size, route)
+    if failed:
+        http_errors.inc(route)
+    return elapsed
+
+
+# === SLOW REQUEST TRACING ===
+
+class Trace:
+    __slots__ = ('started', 'spans')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+
+_trace = ContextVar('trace', default=None)
+slow_requests = deque(maxlen=SLOW_LOG_SIZE)
+
+
+def start_trace():
+    """Begin tracing the current request if tracing is on and it is sampled."""
+    if SLOW_REQUEST_MS <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+def span(kind: str, label: str, started: float):
+    # Tasks spawned by the request (fan-out, paging) share its Trace object
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append((kind, label, started, time.perf_counter()))
+
+
+def _busy(intervals) -> float:
+    # Wall time covered by possibly overlapping intervals
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def finish_trace(trace: Trace, route: str, method: str, status, elapsed: float):
+    if trace is None:
+        return
+    _trace.set(None)
+    if elapsed * 1000 < SLOW_REQUEST_MS:
+        return
+    kinds = {}
+    for kind, label, start, end in trace.spans:
+        entry = kinds.setdefault(kind, {'calls': 0, 'wall_ms': 0.0, 'intervals': []})
+        entry['calls'] += 1
+        entry['intervals'].append((start, end))
+    for entry in kinds.values():
+        entry['wall_ms'] = round(_busy(entry.pop('intervals')) * 1000, 2)
+    io_ms = _busy([(start, end) for _, _, start, end in trace.spans]) * 1000
+    slowest = sorted(trace.spans, key=lambda s: s[3] - s[2], reverse=True)[:5]
+    record = {
+        'route': route,
+        'method': method,
+        'status': status,
+        'duration_ms': round(elapsed * 1000, 2),
+        'upstream': kinds.get('upstream'),
+        'db': kinds.get('db'),
+        # Not waiting on I/O: handler code, validation and JSON encoding
+        'app_ms': round(elapsed * 1000 - io_ms, 2),
+        'slowest': [{'kind': k, 'label': l, 'ms': round((e - s) * 1000, 2)} for k, l, s, e in slowest],
+    }
+    slow_requests.append(record)
+    print(f"Slow request {method} {route} {record['duration_ms']}ms: "
+          f"upstream={(record['upstream'] or {}).get('wall_ms', 0)}ms "
+          f"db={(record['db'] or {}).get('wall_ms', 0)}ms app={record['app_ms']}ms")
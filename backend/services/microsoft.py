@@ -1,34 +1,98 @@
-import httpx
+import heapq
+from services import paging, search, sync
+from services.clients import token_key
+from services.meetings import join_link
+from services.messages import OUTLOOK_FIELDS, hydrate_outlook
+
+GRAPH_URL = "https://graph.microsoft.com/v1.0/me"
+PAGE_HEADERS = {"Prefer": 'odata.maxpagesize=100, outlook.timezone="UTC"'}
+# Newest messages returned per listing, as for Gmail
+MESSAGE_LIMIT = 100
 
 async def get_outlook_messages(token: str):
     if not token:
         return {"messages": []}
-    headers = {"Authorization": f"Bearer {token}"}
-    url = "https://graph.microsoft.com/v1.0/me/messages"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers)
-        return resp.json()
+    try:
+        state = await sync.synced('outlook', token, _mail_sync, _mail_sync, recency=sync.received_at)
+    except sync.UpstreamError as e:
+        return {"value": [], **e.payload}
+    messages = heapq.nlargest(MESSAGE_LIMIT, state.items.values(), key=sync.received_at)
+    result = {"value": await hydrate_outlook(token, messages)}
+    search.index.observe(token_key(token), 'outlook', result)
+    return result
+
+async def _mail_sync(token: str, state):
+    # $select keeps delta pages down to the fields the dashboard shows and
+    # $filter the initial round to the last SYNC_MAIL_DAYS instead of the
+    # whole inbox history; the deltaLink remembers both for later rounds
+    if state.cursor:
+        await _walk_delta(token, state, state.cursor)
+    else:
+        params = {'$select': OUTLOOK_FIELDS, '$filter': f"receivedDateTime ge {sync.mail_since()}"}
+        await _walk_delta(token, state, f"{GRAPH_URL}/mailFolders/inbox/messages/delta", params)
+
+async def iter_outlook_messages(token: str):
+    # Every message in the mailbox (all folders), page by page
+    if not token:
+        return
+    async for message in paging.iter_pages('microsoft', token, f"{GRAPH_URL}/messages", {'$select': OUTLOOK_FIELDS},
+                                           paging.graph_next_page, headers=PAGE_HEADERS):
+        yield message
 
 async def get_calendar_events(token: str):
     if not token:
         return {"value": []}
-    headers = {"Authorization": f"Bearer {token}"}
-    url = "https://graph.microsoft.com/v1.0/me/events"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers)
-        return resp.json()
+    try:
+        state = await calendar_state(token)
+    except sync.UpstreamError as e:
+        return {"value": [], **e.payload}
+    events = sorted(state.items.values(), key=lambda e: (e.get('start') or {}).get('dateTime') or '')
+    result = {"value": events}
+    search.index.observe(token_key(token), 'ms_calendar', result, version=(id(state), state.version))
+    return result
+
+async def calendar_state(token: str):
+    # The synced copy itself, for indexes built on top of it (timeline)
+    return await sync.synced('ms_calendar', token, _calendar_sync, _calendar_sync, recency=sync.nearest_to_now)
+
+async def _calendar_sync(token: str, state):
+    if state.cursor:
+        await _walk_delta(token, state, state.cursor)
+        return
+    # calendarView delta needs a fixed window; it is captured in the deltaLink
+    start, end = sync.calendar_window(state)
+    params = {'startDateTime': start, 'endDateTime': end}
+    await _walk_delta(token, state, f"{GRAPH_URL}/calendarView/delta", params)
+
+async def _walk_delta(token: str, state, url: str, params=None):
+    # Follow @odata.nextLink pages; the last page carries the @odata.deltaLink
+    # used as the cursor for the next round. Graph answers 410 when it expired.
+    while True:
+        data = await sync.fetch_page('microsoft', url, token, params, headers=PAGE_HEADERS)
+        for item in data.get('value', []):
+            if '@removed' in item:
+                state.remove(item['id'])
+            else:
+                state.upsert(item['id'], item)
+        if data.get('@odata.nextLink'):
+            url, params = data['@odata.nextLink'], None
+            continue
+        state.cursor = data.get('@odata.deltaLink')
+        return
+
+async def iter_calendar_events(token: str):
+    if not token:
+        return
+    async for event in paging.iter_pages('microsoft', token, f"{GRAPH_URL}/events", None,
+                                         paging.graph_next_page, headers=PAGE_HEADERS):
+        yield event
 
 async def get_teams_meetings(token: str):
-    # Fetch Microsoft Calendar events and extract Teams meeting links
+    # Teams links from the synced calendar copy; no extra calendar download
     events = await get_calendar_events(token)
     teams_links = []
     for event in events.get('value', []):
-        online_meeting = event.get('onlineMeeting')
-        if online_meeting and 'joinUrl' in online_meeting:
-            teams_links.append(online_meeting['joinUrl'])
-        elif 'body' in event and 'teams.microsoft.com' in event['body'].get('content', ''):
-            # Fallback: search for teams link in event body
-            import re
-            matches = re.findall(r'https://teams.microsoft.com/l/meetup-join[^\s"]+', event['body']['content'])
-            teams_links.extend(matches)
-    return {"teams_links": teams_links} 
\ No newline at end of file
+        link = join_link('microsoft', event)
+        if link:
+            teams_links.append(link)
+    return {"teams_links": teams_links}
@@ -0,0 +1,59 @@
+import asyncio
+import os
+from services import sync
+
+PREFETCH_PAGES = int(os.environ.get('PAGING_PREFETCH', '2'))
+_DONE = object()
+
+
+async def iter_pages(provider: str, token: str, url: str, params=None, next_page=None,
+                     items_key: str = 'value', headers=None, prefetch: int = PREFETCH_PAGES):
+    """Yield items from a paginated list endpoint, one page at a time.
+
+    `next_page(data, url, params)` returns the (url, params) of the next page or
+    None. A background task stays at most `prefetch` pages ahead of the
+    consumer, so memory is bounded by the page size whatever the list length.
+    """
+    queue = asyncio.Queue(maxsize=max(prefetch, 1))
+
+    async def produce():
+        nonlocal url, params
+        try:
+            while True:
+                data = await sync.fetch_page(provider, url, token, params, gone=(), headers=headers)
+                await queue.put(data.get(items_key, []))
+                following = next_page(data, url, params)
+                if following is None:
+                    break
+                url, params = following
+            await queue.put(_DONE)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            page = await queue.get()
+            if page is _DONE:
+                return
+            if isinstance(page, Exception):
+                raise page
+            for item in page:
+                yield item
+    finally:
+        producer.cancel()
+        # Let it finish unwinding so it isn't destroyed while still pending
+        await asyncio.wait([producer])
+
+
+def google_next_page(data, url, params):
+    token = data.get('nextPageToken')
+    if not token:
+        return None
+    return url, {**(params or {}), 'pageToken': token}
+
+
+def graph_next_page(data, url, params):
+    # nextLink already carries every query parameter
+    link = data.get('@odata.nextLink')
+    return (link, None) if link else None
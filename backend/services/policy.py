@@ -0,0 +1,279 @@
+import asyncio
+import email.utils
+import os
+import random
+import time
+from collections import OrderedDict
+import httpx
+
+# Client-side traffic policy for upstream providers: a token bucket per user
+# and provider, retries with exponential backoff and full jitter for
+# idempotent requests (honoring Retry-After), and a circuit breaker that
+# fails fast while a provider keeps erroring.
+#
+# Google and Graph throttle per user or mailbox, so a 429 only backs off the
+# user it was sent for; the provider-wide breaker counts 5xx responses and
+# transport failures only. Per-user buckets also keep background refreshes
+# for many users from queueing everybody's interactive requests.
+
+RETRIES = int(os.environ.get('UPSTREAM_RETRIES', '2'))
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 5.0
+MAX_RETRY_AFTER = float(os.environ.get('UPSTREAM_MAX_RETRY_AFTER', '5'))
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', '30'))
+
+MAX_BUCKETS = int(os.environ.get('UPSTREAM_MAX_BUCKETS', '10000'))
+
+# requests per second, burst; per user (or per provider for calls without one)
+RATES = {
+    'google': (20.0, 40),
+    'microsoft': (20.0, 40),
+    'github': (10.0, 20),
+    'auth0': (10.0, 20),
+    'ipapi': (0.75, 45),  # free tier: 45 requests a minute
+}
+
+IDEMPOTENT = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class UpstreamError(Exception):
+    def __init__(self, payload):
+        super().__init__(str(payload))
+        self.payload = payload
+
+
+class ProviderUnavailable(UpstreamError):
+    """The provider's circuit is open; callers should fall back to cached data."""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__({
+            'error': f'{provider} is temporarily unavailable',
+            'status': 'unavailable',
+            'retry_in': round(retry_in, 1),
+        })
+        self.provider = provider
+
+
+class Throttled(ProviderUnavailable):
+    """The provider asked us to back off for this user (429 with a long Retry-After)."""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(provider, retry_in)
+        self.payload['error'] = f'{provider} is rate limiting this account'
+        self.payload['status'] = 'throttled'
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.wait_time())
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trial = False
+        self.state = 'closed'
+
+    def allow(self) -> bool:
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() >= self.opened_until:
+            # Half-open: let a single trial request through
+            self.state = 'half_open'
+            self.trial = False
+        if self.state == 'half_open' and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_until - time.monotonic())
+
+    def success(self):
+        self.failures = 0
+        self.state = 'closed'
+
+    def failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.threshold:
+            self.trip()
+
+    def trip(self, hold: float = 0.0):
+        self.state = 'open'
+        self.opened_until = time.monotonic() + max(self.cooldown, hold)
+
+    def release(self):
+        # The half-open trial ended without a verdict (e.g. cancelled)
+        if self.state == 'half_open':
+            self.trial = False
+
+
+class ProviderPolicy:
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.buckets = OrderedDict()  # user -> TokenBucket, least recently used first
+        self.held = {}  # user -> monotonic time until which a 429 asked us to wait
+        self.breaker = CircuitBreaker()
+        self.retries = 0
+        self.throttled = 0
+        self.short_circuited = 0
+
+    def bucket(self, user: str = None) -> TokenBucket:
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            rate, burst = RATES.get(self.provider, (10.0, 20))
+            bucket = self.buckets[user] = TokenBucket(rate, burst)
+            while len(self.buckets) > MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user)
+        return bucket
+
+    def hold(self, user: str, seconds: float):
+        now = time.monotonic()
+        if len(self.held) >= MAX_BUCKETS:
+            self.held = {u: until for u, until in self.held.items() if until > now}
+        self.held[user] = now + seconds
+
+    def held_for(self, user: str) -> float:
+        until = self.held.get(user)
+        if until is None:
+            return 0.0
+        if until <= time.monotonic():
+            del self.held[user]
+            return 0.0
+        return until - time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'retry_in': round(self.breaker.retry_in(), 1),
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'throttled_users': sum(1 for until in self.held.values() if until > now),
+            'short_circuited': self.short_circuited,
+        }
+
+
+_policies = {}
+
+
+def policy_for(provider: str) -> ProviderPolicy:
+    policy = _policies.get(provider)
+    if policy is None:
+        policy = _policies[provider] = ProviderPolicy(provider)
+    return policy
+
+
+def _retry_after(resp: httpx.Response):
+    value = resp.headers.get('retry-after')
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+async def send(provider: str, method: str, request, user: str = None, wait: bool = True):
+    """Run `request()` (returning an httpx.Response) under the provider's policy.
+
+    `user` (a token_key) scopes rate limiting and 429 back-off to one account.
+    With `wait=False` an empty token bucket raises Throttled instead of
+    queueing the request.
+    """
+    policy = policy_for(provider)
+    breaker = policy.breaker
+    if user:
+        held = policy.held_for(user)
+        if held:
+            policy.short_circuited += 1
+            raise Throttled(provider, held)
+    if not breaker.allow():
+        policy.short_circuited += 1
+        raise ProviderUnavailable(provider, breaker.retry_in())
+
+    bucket = policy.bucket(user)
+    attempts = 1 + (RETRIES if method.upper() in IDEMPOTENT else 0)
+    for attempt in range(attempts):
+        if wait:
+            await bucket.acquire()
+        elif not bucket.try_acquire():
+            breaker.release()
+            policy.throttled += 1
+            raise Throttled(provider, bucket.wait_time())
+        last = attempt == attempts - 1
+        try:
+            resp = await request()
+        except httpx.TransportError:
+            breaker.failure()
+            if last or breaker.state == 'open':
+                raise
+            policy.retries += 1
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+
+        if resp.status_code != 429 and resp.status_code < 500:
+            breaker.success()
+            return resp
+
+        wait = _retry_after(resp)
+        throttled = resp.status_code == 429
+        if throttled:
+            # Throttling says nothing about the provider's health
+            policy.throttled += 1
+            breaker.release()
+        if wait is not None and wait > MAX_RETRY_AFTER:
+            # Don't sit on a long Retry-After inside a request: stop sending
+            # (for this user on a 429, to the provider on a 5xx) until it has
+            # passed and hand back the response
+            if not throttled:
+                breaker.trip(wait)
+            elif user:
+                policy.hold(user, wait)
+            return resp
+        if not throttled:
+            breaker.failure()
+        if last or breaker.state == 'open':
+            return resp
+        policy.retries += 1
+        await asyncio.sleep(max(wait or 0.0, _backoff(attempt)))
+    return resp
+
+
+def stats():
+    return {provider: policy.stats() for provider, policy in _policies.items()}
@@ -0,0 +1,51 @@
+# Server-side field projection for `?fields=`. The spec is a comma-separated
+# list of dotted paths; lists are walked through transparently, so
+#
+#   fields=items.id,items.summary,items.start.dateTime
+#
+# keeps those three fields of every calendar event. Envelope keys describing
+# how a result was obtained (status, error, ...) are kept on objects outside
+# of lists, so a projected response still says when it is stale.
+# Projection builds new containers and never mutates its input, which may be
+# a shared cached object.
+
+META_KEYS = ('status', 'error', 'retry_in', 'fetched_at')
+
+
+def parse_fields(spec: str):
+    """Turn 'a.b,a.c,d' into {'a': {'b': {}, 'c': {}}, 'd': {}}; None for no projection."""
+    if not spec:
+        return None
+    tree = {}
+    for path in spec.split(','):
+        parts = [p for p in path.strip().split('.') if p]
+        if not parts:
+            continue
+        node = tree
+        for i, part in enumerate(parts):
+            child = node.get(part)
+            if child is None:
+                child = node[part] = {}
+            elif not child and i < len(parts) - 1:
+                # 'a' already asked for the whole subtree; 'a.b' can't narrow it
+                break
+            node = child
+        else:
+            # A shorter path wins over longer ones below it
+            node.clear()
+    return tree or None
+
+
+def project(value, tree, in_list: bool = False):
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree, True) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {key: project(value[key], sub, in_list) for key, sub in tree.items() if key in value}
+    if not in_list:
+        for key in META_KEYS:
+            if key in value and key not in result:
+                result[key] = value[key]
+    return result
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from services import clients, github, google, microsoft
+from services.changes import feed
+
+# Background pre-warming for recently active users. Each active user is
+# refreshed a little before their cached provider data would expire (with
+# jitter so refreshes don't line up), by a fixed pool of workers. Users seen
+# in the last ONLINE_WINDOW seconds are picked first when the pool is busy.
+
+REFRESH_INTERVAL = float(os.environ.get('REFRESH_INTERVAL', '45'))
+ACTIVE_WINDOW = float(os.environ.get('REFRESH_ACTIVE_WINDOW', '900'))
+ONLINE_WINDOW = float(os.environ.get('REFRESH_ONLINE_WINDOW', '120'))
+WORKERS = int(os.environ.get('REFRESH_WORKERS', '4'))
+REFRESH_TIMEOUT = float(os.environ.get('REFRESH_TIMEOUT', '20'))
+JITTER = 0.2
+
+
+class _User:
+    __slots__ = ('token', 'last_seen', 'due', 'running', 'online')
+
+    def __init__(self, token):
+        self.token = token
+        self.last_seen = time.monotonic()
+        self.due = None
+        self.running = False
+        self.online = False
+
+
+class RefreshScheduler:
+    def __init__(self, refresh, workers: int = WORKERS, interval: float = REFRESH_INTERVAL):
+        self.refresh = refresh
+        self.workers = workers
+        self.interval = interval
+        self._users = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._queue = None
+        self._wakeup = None
+        self._tasks = []
+        self.refreshed = 0
+        self.failed = 0
+
+    def touch(self, user: str, token: str, online: bool = False):
+        """Record activity; the user's data is kept warm while they stay active."""
+        entry = self._users.get(user)
+        if entry is None:
+            entry = self._users[user] = _User(token)
+        entry.token = token
+        entry.last_seen = time.monotonic()
+        entry.online = online or entry.online
+        if entry.due is None and not entry.running:
+            self._schedule(user, entry)
+
+    def forget(self, user: str):
+        # Stops refreshes; a queued heap entry is skipped once its user is gone
+        self._users.pop(user, None)
+
+    def set_online(self, user: str, online: bool):
+        entry = self._users.get(user)
+        if entry is not None:
+            entry.online = online
+
+    def _schedule(self, user: str, entry: _User):
+        # Always a bit ahead of the interval, never after it
+        entry.due = time.monotonic() + self.interval * random.uniform(1 - JITTER, 1)
+        heapq.heappush(self._heap, (entry.due, next(self._seq), user))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _priority(self, entry: _User):
+        return 0 if entry.online or time.monotonic() - entry.last_seen < ONLINE_WINDOW else 1
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, user = heapq.heappop(self._heap)
+                entry = self._users.get(user)
+                if entry is None or entry.due != due:
+                    continue  # superseded heap entry
+                entry.due = None
+                if now - entry.last_seen > ACTIVE_WINDOW and not entry.online:
+                    del self._users[user]
+                    continue
+                entry.running = True
+                self._queue.put_nowait((self._priority(entry), next(self._seq), user))
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            _, _, user = await self._queue.get()
+            entry = self._users.get(user)
+            if entry is None:
+                continue
+            token = clients.refreshing.set(True)
+            try:
+                await asyncio.wait_for(self.refresh(entry.token), REFRESH_TIMEOUT)
+                self.refreshed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"Background refresh failed: {e}")
+            finally:
+                clients.refreshing.reset(token)
+                entry.running = False
+            if user in self._users:
+                self._schedule(user, entry)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._dispatch())]
+        self._tasks += [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'active_users': len(self._users),
+            'online_users': sum(1 for e in self._users.values() if self._priority(e) == 0),
+            'scheduled': len(self._heap),
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'workers': self.workers,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+        }
+
+
+async def refresh_user(token: str):
+    # Same calls the dashboard, mail and calendar routes make; with
+    # clients.refreshing set they bypass fresh cache entries and sync intervals.
+    # Results go through the change feed so open live dashboards get the diffs.
+    calls = {
+        'google_calendar': google.get_calendar_events(token),
+        'gmail': google.get_gmail_messages(token),
+        'ms_calendar': microsoft.get_calendar_events(token),
+        'outlook': microsoft.get_outlook_messages(token),
+        'github': github.get_profile(token),
+    }
+    results = await asyncio.gather(*calls.values(), return_exceptions=True)
+    user = clients.token_key(token)
+    errors = []
+    for kind, result in zip(calls, results):
+        if isinstance(result, Exception):
+            errors.append(result)
+        else:
+            feed.observe(user, kind, result)
+    if errors:
+        raise errors[0]
+
+
+scheduler = RefreshScheduler(refresh_user)
@@ -0,0 +1,292 @@
+import os
+import re
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from math import log
+from services.times import parse_timestamp
+
+# Per-user full-text index over data the backend already has: mail subjects
+# and senders, event titles, organizers, attendees and locations, GitHub
+# profile fields. Services report what they fetched through observe(); only
+# documents whose indexed fields changed are re-tokenized, so keeping the
+# index current costs little more than a comparison per item. Queries never
+# go upstream.
+#
+# Terms are kept in a sorted list next to the postings, so a query token
+# matches by prefix with a binary search. Every query token must match; the
+# score sums field weight x idf per token (exact matches count more than
+# prefixes) and ties go to the more recent item.
+
+MAX_USERS = int(os.environ.get('SEARCH_MAX_USERS', '1000'))
+MIN_TOKEN = 2
+PREFIX_WEIGHT = 0.6
+MAX_PREFIX_TERMS = 200  # cap on terms one short prefix can expand to
+
+FIELD_WEIGHTS = {'title': 3.0, 'people': 2.0, 'login': 3.0, 'location': 1.0, 'text': 1.0}
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) >= MIN_TOKEN] if text else []
+
+
+def _timestamp(value):
+    if not value:
+        return 0.0
+    if isinstance(value, (int, float)) or value.isdigit():
+        return int(value) / 1000  # Gmail internalDate, ms
+    return parse_timestamp(value) or 0.0
+
+
+def _people(*entries):
+    return ' '.join(filter(None, entries))
+
+
+# === EXTRACTORS ===
+# Each returns (fields, summary) for one item: `fields` is what gets indexed,
+# `summary` what a search result shows.
+
+def _gmail(message):
+    fields = {'title': message.get('subject'), 'people': message.get('from'), 'text': message.get('snippet')}
+    return fields, {
+        'title': message.get('subject') or '',
+        'from': message.get('from') or '',
+        'time': _timestamp(message.get('internalDate')),
+    }
+
+
+def _outlook(message):
+    sender = (message.get('from') or {}).get('emailAddress') or {}
+    fields = {
+        'title': message.get('subject'),
+        'people': _people(sender.get('name'), sender.get('address')),
+        'text': message.get('bodyPreview'),
+    }
+    return fields, {
+        'title': message.get('subject') or '',
+        'from': sender.get('name') or sender.get('address') or '',
+        'time': _timestamp(message.get('receivedDateTime')),
+        'link': message.get('webLink'),
+    }
+
+
+def _google_event(event):
+    organizer = event.get('organizer') or {}
+    people = [organizer.get('displayName'), organizer.get('email')]
+    for attendee in event.get('attendees') or []:
+        people += [attendee.get('displayName'), attendee.get('email')]
+    start = event.get('start') or {}
+    fields = {'title': event.get('summary'), 'people': _people(*people), 'location': event.get('location')}
+    return fields, {
+        'title': event.get('summary') or '',
+        'from': organizer.get('displayName') or organizer.get('email') or '',
+        'time': _timestamp(start.get('dateTime') or start.get('date')),
+        'link': event.get('htmlLink'),
+    }
+
+
+def _ms_event(event):
+    organizer = (event.get('organizer') or {}).get('emailAddress') or {}
+    people = [organizer.get('name'), organizer.get('address')]
+    for attendee in event.get('attendees') or []:
+        address = attendee.get('emailAddress') or {}
+        people += [address.get('name'), address.get('address')]
+    fields = {
+        'title': event.get('subject'),
+        'people': _people(*people),
+        'location': (event.get('location') or {}).get('displayName'),
+    }
+    return fields, {
+        'title': event.get('subject') or '',
+        'from': organizer.get('name') or organizer.get('address') or '',
+        'time': _timestamp((event.get('start') or {}).get('dateTime')),
+        'link': event.get('webLink'),
+    }
+
+
+def _github(profile):
+    fields = {
+        'login': profile.get('login'),
+        'title': profile.get('name'),
+        'people': _people(profile.get('email'), profile.get('company')),
+        'location': profile.get('location'),
+        'text': _people(profile.get('bio'), profile.get('blog')),
+    }
+    return fields, {
+        'title': profile.get('name') or profile.get('login') or '',
+        'from': profile.get('login') or '',
+        'time': 0.0,
+        'link': profile.get('html_url'),
+    }
+
+
+# kind -> (key holding the item list or None for a single object, extractor)
+SOURCES = {
+    'gmail': ('messages', _gmail),
+    'outlook': ('value', _outlook),
+    'google_calendar': ('items', _google_event),
+    'ms_calendar': ('value', _ms_event),
+    'github': (None, _github),
+}
+
+
+class _Doc:
+    __slots__ = ('kind', 'id', 'fields', 'terms', 'summary')
+
+    def __init__(self, kind, id, fields, terms, summary):
+        self.kind = kind
+        self.id = id
+        self.fields = fields
+        self.terms = terms
+        self.summary = summary
+
+
+class UserIndex:
+    def __init__(self):
+        self.docs = {}
+        self.by_kind = {}
+        self.postings = {}
+        self.terms = []  # sorted, for prefix lookups
+        self.versions = {}
+
+    def _add(self, key, doc):
+        self.docs[key] = doc
+        self.by_kind.setdefault(doc.kind, set()).add(key)
+        for term, weight in doc.terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.terms, term)
+            posting[key] = weight
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        self.by_kind[doc.kind].discard(key)
+        for term in doc.terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(key, None)
+            if not posting:
+                del self.postings[term]
+                i = bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+
+    def update(self, kind: str, items, extract):
+        seen = set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item_id = item.get('id') or (item.get('login') if kind == 'github' else None)
+            if not item_id:
+                continue
+            key = (kind, item_id)
+            seen.add(key)
+            fields, summary = extract(item)
+            existing = self.docs.get(key)
+            if existing is not None and existing.fields == fields:
+                existing.summary = summary
+                continue
+            terms = {}
+            for field, text in fields.items():
+                weight = FIELD_WEIGHTS[field]
+                for token in tokenize(text):
+                    terms[token] = max(terms.get(token, 0.0), weight)
+            if existing is not None:
+                self._remove(key)
+            self._add(key, _Doc(kind, item_id, fields, terms, summary))
+        # Whatever the latest copy no longer has is gone upstream
+        for key in self.by_kind.get(kind, set()) - seen:
+            self._remove(key)
+
+    def _matches(self, token):
+        # {doc key: best weight} for terms equal to or starting with token
+        found = {}
+        start = bisect_left(self.terms, token)
+        for term in self.terms[start:start + MAX_PREFIX_TERMS]:
+            if not term.startswith(token):
+                break
+            posting = self.postings[term]
+            factor = (1.0 if term == token else PREFIX_WEIGHT) * log(1 + len(self.docs) / len(posting))
+            for key, weight in posting.items():
+                score = weight * factor
+                if score > found.get(key, 0.0):
+                    found[key] = score
+        return found
+
+    def search(self, query: str, limit: int = 20, kinds=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        scores = None
+        # Rarest-looking (longest) tokens first keeps the candidate set small
+        for token in sorted(set(tokens), key=len, reverse=True):
+            matches = self._matches(token)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+            if not scores:
+                return []
+        if kinds:
+            scores = {key: score for key, score in scores.items() if key[0] in kinds}
+        ranked = sorted(scores.items(), key=lambda kv: (kv[1], self.docs[kv[0]].summary['time']), reverse=True)
+        return [
+            {'kind': key[0], 'id': key[1], 'score': round(score, 3), **self.docs[key].summary}
+            for key, score in ranked[:limit]
+        ]
+
+    def stats(self):
+        return {kind: len(keys) for kind, keys in self.by_kind.items() if keys}
+
+
+class SearchIndex:
+    def __init__(self, max_users: int = MAX_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()
+
+    def _index(self, user: str, create: bool):
+        index = self._users.get(user)
+        if index is None:
+            if not create:
+                return None
+            index = self._users[user] = UserIndex()
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user)
+        return index
+
+    def observe(self, user: str, kind: str, data, version=None):
+        """Index a fresh provider result (same shapes as the service getters return).
+
+        `version` (e.g. a SyncState version) lets unchanged copies skip the
+        per-item comparison entirely.
+        """
+        if not user or not isinstance(data, dict) or 'error' in data:
+            return
+        items_key, extract = SOURCES[kind]
+        index = self._index(user, True)
+        if version is not None:
+            if index.versions.get(kind) == version:
+                return
+            index.versions[kind] = version
+        items = data.get(items_key, []) if items_key else [data]
+        index.update(kind, items, extract)
+
+    def search(self, user: str, query: str, limit: int = 20, kinds=None):
+        index = self._index(user, False)
+        if index is None:
+            return [], {}
+        return index.search(query, limit, kinds), index.stats()
+
+    def drop(self, user: str):
+        self._users.pop(user, None)
+
+
+index = SearchIndex()
+
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from services import metrics
+
+# Collapses identical concurrent upstream calls: the first caller for a key
+# starts the work, later callers for the same key await that same task and
+# share its result or exception. A caller that is cancelled only stops
+# waiting; the shared work is cancelled once nobody is waiting for it.
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.collapsed = 0
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.started += 1
+        else:
+            self.collapsed += 1
+
+        call.waiters += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            if shared:
+                # The work runs in the first caller's context; the wait still
+                # counts as upstream time in this caller's trace
+                metrics.span('upstream', 'shared', started)
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self):
+        total = self.started + self.collapsed
+        return {
+            'in_flight': len(self._calls),
+            'started': self.started,
+            'collapsed': self.collapsed,
+            'collapse_ratio': round(self.collapsed / total, 4) if total else 0.0,
+        }
+
+
+flights = SingleFlight()
@@ -0,0 +1,184 @@
+import asyncio
+import heapq
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from services import clients
+from services.clients import token_key
+from services.policy import ProviderUnavailable, UpstreamError
+from services.singleflight import flights
+from services.times import parse_timestamp
+
+# A synced copy younger than this is returned without asking upstream for changes
+MIN_INTERVAL = float(os.environ.get('SYNC_MIN_INTERVAL', '15'))
+MAX_STATES = int(os.environ.get('SYNC_MAX_STATES', '4096'))
+MAX_ITEMS = int(os.environ.get('SYNC_MAX_ITEMS', '2000'))
+# How far back an initial sync reaches; later rounds only ask for changes
+CALENDAR_PAST_DAYS = int(os.environ.get('SYNC_CALENDAR_PAST_DAYS', '30'))
+CALENDAR_FUTURE_DAYS = int(os.environ.get('SYNC_CALENDAR_FUTURE_DAYS', '180'))
+MAIL_DAYS = int(os.environ.get('SYNC_MAIL_DAYS', '30'))
+# Calendar listings cover a fixed window; re-list once it has moved this far
+WINDOW_REFRESH = float(os.environ.get('SYNC_WINDOW_REFRESH', '86400'))
+
+
+class Resync(Exception):
+    """Raised by an incremental step when the stored cursor is no longer valid."""
+
+
+class SyncState:
+    """Sync cursor plus the materialized items it describes."""
+
+    def __init__(self):
+        self.cursor = None
+        self.items = OrderedDict()
+        self.synced_at = 0.0
+        self.resync_at = 0.0  # monotonic time after which to run a full sync again; 0 for never
+        self.version = 0  # bumped on every change, for derived indexes
+        self.lock = asyncio.Lock()
+
+    def upsert(self, item_id, item, newest_first: bool = False):
+        self.version += 1
+        if item_id in self.items:
+            self.items[item_id] = item
+            return
+        self.items[item_id] = item
+        if newest_first:
+            self.items.move_to_end(item_id, last=False)
+
+    def trim(self, recency=None, limit: int = MAX_ITEMS):
+        """Cut the copy down to `limit` items, keeping the most recent ones.
+
+        `recency(item)` gives a sort key, larger meaning more worth keeping.
+        Without one the items are taken to be in newest-first order (see
+        upsert(newest_first=True)) and the tail goes.
+        """
+        excess = len(self.items) - limit
+        if excess <= 0:
+            return
+        self.version += 1
+        if recency is None:
+            for _ in range(excess):
+                self.items.popitem(last=True)
+            return
+        keep = {item_id for item_id, _ in heapq.nlargest(limit, self.items.items(), key=lambda kv: recency(kv[1]))}
+        self.items = OrderedDict((item_id, item) for item_id, item in self.items.items() if item_id in keep)
+
+    def remove(self, item_id):
+        if self.items.pop(item_id, None) is not None:
+            self.version += 1
+
+    def reset(self):
+        self.cursor = None
+        self.items = OrderedDict()
+        self.synced_at = 0.0
+        self.resync_at = 0.0
+        self.version += 1
+
+
+class SyncStore:
+    def __init__(self, max_states: int = MAX_STATES):
+        self.max_states = max_states
+        self._states = OrderedDict()
+
+    def get(self, key) -> SyncState:
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = SyncState()
+            while len(self._states) > self.max_states:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(key)
+        return state
+
+    def drop_user(self, user: str):
+        for key in [k for k in self._states if k[0] == user]:
+            del self._states[key]
+
+
+store = SyncStore()
+
+
+async def synced(kind: str, token: str, full, incremental, force: bool = False, recency=None) -> SyncState:
+    """Bring the (user, kind) copy up to date and return it.
+
+    `full(token, state)` rebuilds state from scratch and `incremental(token, state)`
+    applies changes since `state.cursor`; the latter raises Resync when the
+    provider has invalidated the cursor (410 / expired history). Past
+    MAX_ITEMS the copy is trimmed by `recency` (see SyncState.trim), so new
+    arrivals are kept and the oldest items go.
+
+    Concurrent calls for the same copy share one sync run, so a caller that
+    goes away mid-sync doesn't abort it for the others.
+    """
+    key = (token_key(token), kind)
+    force = force or clients.refreshing.get()
+    return await flights.do(('sync', *key, force), lambda: _sync(key, kind, token, full, incremental, force, recency))
+
+
+async def _sync(key, kind, token, full, incremental, force, recency):
+    state = store.get(key)
+    async with state.lock:
+        if state.cursor and state.resync_at and time.monotonic() >= state.resync_at:
+            # The window the cursor was created for has drifted; start over
+            state.cursor = None
+        if not force and state.cursor and time.monotonic() - state.synced_at < MIN_INTERVAL:
+            return state
+        if state.cursor:
+            try:
+                await incremental(token, state)
+            except ProviderUnavailable:
+                # Provider is being short-circuited: keep serving the copy we have
+                return state
+            except Resync:
+                print(f"Sync cursor for {kind} invalidated, running full resync")
+                state.reset()
+                await full(token, state)
+        else:
+            state.reset()
+            await full(token, state)
+        state.trim(recency)
+        state.synced_at = time.monotonic()
+    return state
+
+
+def received_at(item):
+    # Recency key for mail: ISO UTC timestamps sort as strings
+    return item.get('receivedDateTime') or ''
+
+
+def nearest_to_now(item):
+    """Recency key for events: the closer an event starts to now, the more worth keeping."""
+    start = item.get('start') or {}
+    begins = parse_timestamp(start.get('dateTime') or start.get('date'))
+    return float('-inf') if begins is None else -abs(begins - time.time())
+
+
+def _iso(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def calendar_window(state=None):
+    """(start, end) of the initial calendar sync, as UTC ISO strings.
+
+    Given the state being synced, schedules the full sync that moves the
+    window forward again.
+    """
+    if state is not None:
+        state.resync_at = time.monotonic() + WINDOW_REFRESH
+    now = datetime.now(timezone.utc)
+    return _iso(now - timedelta(days=CALENDAR_PAST_DAYS)), _iso(now + timedelta(days=CALENDAR_FUTURE_DAYS))
+
+
+def mail_since() -> str:
+    return _iso(datetime.now(timezone.utc) - timedelta(days=MAIL_DAYS))
+
+
+async def fetch_page(provider: str, url: str, token: str, params=None, gone=(410,), headers=None):
+    resp = await clients.fetch(provider, url, token, params=params, headers=headers)
+    if resp.status_code in gone:
+        raise Resync()
+    data = resp.json()
+    if not resp.is_success:
+        raise UpstreamError(data)
+    return data
@@ -0,0 +1,140 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from services.meetings import join_link
+from services.times import parse_timestamp
+
+# One time-ordered view over Google and Microsoft calendars. Events are
+# normalized into compact Event rows, each provider's list is sorted once and
+# the lists are k-way merged; TimelineIndex then answers range and "next N"
+# queries with binary searches instead of scanning every event.
+
+MAX_INDEXES = 1024
+
+
+class Event:
+    __slots__ = ('start', 'end', 'title', 'provider', 'join_url', 'id', 'all_day')
+
+    def __init__(self, start, end, title, provider, join_url=None, id=None, all_day=False):
+        self.start = start
+        self.end = end
+        self.title = title
+        self.provider = provider
+        self.join_url = join_url
+        self.id = id
+        self.all_day = all_day
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'provider': self.provider,
+            'title': self.title,
+            'start': _iso(self.start),
+            'end': _iso(self.end),
+            'allDay': self.all_day,
+            'joinUrl': self.join_url,
+        }
+
+
+def _iso(ts: float):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def from_google(event: dict):
+    start, end = event.get('start') or {}, event.get('end') or {}
+    begins = parse_timestamp(start.get('dateTime') or start.get('date'))
+    if begins is None:
+        return None
+    ends = parse_timestamp(end.get('dateTime') or end.get('date')) or begins
+    return Event(begins, ends, event.get('summary') or '(No title)', 'google',
+                 join_link('google', event), event.get('id'), 'date' in start)
+
+
+def from_microsoft(event: dict):
+    start, end = event.get('start') or {}, event.get('end') or {}
+    begins = parse_timestamp(start.get('dateTime'))
+    if begins is None:
+        return None
+    ends = parse_timestamp(end.get('dateTime')) or begins
+    return Event(begins, ends, event.get('subject') or '(No title)', 'microsoft',
+                 join_link('microsoft', event), event.get('id'), bool(event.get('isAllDay')))
+
+
+def normalize(events, convert):
+    rows = [row for row in map(convert, events) if row is not None]
+    rows.sort(key=lambda e: e.start)
+    return rows
+
+
+def merge(*streams):
+    """k-way merge of per-provider lists that are each sorted by start."""
+    return list(heapq.merge(*streams, key=lambda e: e.start))
+
+
+class TimelineIndex:
+    def __init__(self, events):
+        self.events = events
+        self.starts = [e.start for e in events]
+        # Running maximum of end times: an event can only overlap t if some
+        # event at or before it ends after t, so this bounds the left edge
+        self.max_ends = []
+        latest = float('-inf')
+        for event in events:
+            latest = max(latest, event.end)
+            self.max_ends.append(latest)
+
+    def between(self, start: float, end: float, limit: int = None):
+        """Events overlapping [start, end)."""
+        lo = bisect_right(self.max_ends, start)
+        hi = bisect_left(self.starts, end)
+        result = []
+        for event in self.events[lo:hi]:
+            # Zero-length events count when they sit inside the range
+            if event.end > start or event.start >= start:
+                result.append(event)
+                if limit and len(result) >= limit:
+                    break
+        return result
+
+    def upcoming(self, now: float, limit: int = 10):
+        """The next `limit` events that have not ended yet, in start order."""
+        result = []
+        for i in range(bisect_right(self.max_ends, now), len(self.events)):
+            event = self.events[i]
+            if event.end > now:
+                result.append(event)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def __len__(self):
+        return len(self.events)
+
+
+_indexes = OrderedDict()
+
+
+def drop(user: str):
+    _indexes.pop(user, None)
+
+
+def index_for(user: str, google_state=None, microsoft_state=None) -> TimelineIndex:
+    # Rebuilt only when one of the synced calendars changed since last time
+    version = tuple((id(state), state.version) if state is not None else None
+                    for state in (google_state, microsoft_state))
+    cached = _indexes.get(user)
+    if cached is not None and cached[0] == version:
+        _indexes.move_to_end(user)
+        return cached[1]
+    streams = []
+    if google_state is not None:
+        streams.append(normalize(google_state.items.values(), from_google))
+    if microsoft_state is not None:
+        streams.append(normalize(microsoft_state.items.values(), from_microsoft))
+    index = TimelineIndex(merge(*streams))
+    _indexes[user] = (version, index)
+    _indexes.move_to_end(user)
+    while len(_indexes) > MAX_INDEXES:
+        _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+
+
+def parse_timestamp(value):
+    """Epoch seconds for an ISO 8601 time from Google or Graph, or None.
+
+    Before Python 3.11 fromisoformat() rejects a trailing 'Z' and more than
+    six fractional digits (Graph sends seven), so both are normalized first.
+    Naive times are UTC: Graph is asked for UTC and all-day dates have no zone.
+    """
+    if not value or not isinstance(value, str):
+        return None
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    if '.' in value:
+        head, _, rest = value.partition('.')
+        digits = len(rest) - len(rest.lstrip('0123456789'))
+        value = f"{head}.{rest[:digits][:6].ljust(6, '0')}{rest[digits:]}"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
@@ -0,0 +1,77 @@
+"""Run the API with uvicorn.
+
+    python start.py                 # one worker per available CPU
+    WORKERS=1 RELOAD=1 python start.py   # development, auto-reload
+
+Every worker is a separate process with its own connection pools, caches
+and Firebase client, all created lazily in the app lifespan after the
+worker starts. For process supervision in production use gunicorn with the
+config next to this file: `gunicorn -c gunicorn.conf.py main:app`.
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+REQUIRED_ENV = ('AUTH0_DOMAIN', 'AUTH0_CLIENT_ID', 'AUTH0_CLIENT_SECRET', 'AUTH0_CALLBACK_URL')
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually use: affinity mask and cgroup quota included."""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    try:
+        # cgroup v2 quota, e.g. "200000 100000" for two CPUs, or "max 100000"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, count)
+
+
+def worker_count() -> int:
+    # WEB_CONCURRENCY is the conventional name used by most hosting platforms
+    value = os.environ.get('WORKERS') or os.environ.get('WEB_CONCURRENCY')
+    return int(value) if value else available_cpus()
+
+
+def check_env():
+    missing = [name for name in REQUIRED_ENV if not os.environ.get(name)]
+    if missing:
+        print(f"Warning: missing environment variables: {', '.join(missing)}")
+
+
+def main():
+    from dotenv import load_dotenv
+    import uvicorn
+
+    # Same behavior wherever it is launched from
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    load_dotenv()
+    check_env()
+
+    reload = os.environ.get('RELOAD') == '1'
+    workers = 1 if reload else worker_count()
+    host = os.environ.get('HOST', '0.0.0.0')
+    port = int(os.environ.get('PORT', '8000'))
+    print(f"Starting {workers} worker(s) on {host}:{port}")
+    uvicorn.run(
+        'main:app',
+        host=host,
+        port=port,
+        workers=workers,
+        reload=reload,
+        # Long enough for pending deferred writes to flush
+        timeout_graceful_shutdown=int(os.environ.get('GRACEFUL_TIMEOUT', '20')),
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+    )
+
+
+if __name__ == '__main__':
+    main()